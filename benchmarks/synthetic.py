@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Generator of synthetic documents and translation catalogs for benchmarks.
+
+Documents are split into a root file and chapters included with \\input, and
+contain a configurable mix of tags. Catalogs are complete translations with
+the Plural-Forms rules msginit would use for the locale. To write a sample:
+
+    python -m benchmarks.synthetic --directory /tmp/synthetic --tags 10000
+'''
+
+import argparse
+import os
+import random
+import sys
+
+import catalog
+import translator
+
+DEFAULT_MIX = 'gettext=6,pgettext=2,ngettext=2,npgettext=1,formatdate=1'
+DEFAULT_LOCALES = 'de_DE,pl_PL,ru_RU,ar_EG'
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua').split()
+
+def parse_mix(mix):
+    '''Parses "name=weight,..." into a list of (tag name, weight)'''
+    result = []
+    for i in mix.split(','):
+        name, weight = i.split('=')
+        name = '\\'+name.strip()
+        if name not in translator.TAGS or name in translator.INCLUDE_TAGS:
+            raise Exception('Unknown tag: '+name)
+        result.append((name, int(weight)))
+    return result
+
+class Generator:
+    def __init__(self, tags=1000, messages=None, mix=DEFAULT_MIX, depth=1, chapters=10, seed=0):
+        self.tags = tags
+        self.messages = messages or max(tags // 4, 1)
+        self.mix = parse_mix(mix)
+        self.depth = depth
+        self.chapters = chapters
+        self.random = random.Random(seed)
+
+    def _phrase(self, index):
+        words = [ WORDS[(index+i) % len(WORDS)] for i in range(3+index % 5) ]
+        text = ' '.join(words)+' {}'.format(index)
+        for _ in range(self.depth-1):
+            text = '{\\em '+text+'}'
+        return text
+
+    def _tag(self, name):
+        # plural messages get own identifiers, as catalogs cannot have both forms under one key
+        index = self.random.randrange(self.messages)
+        if name == '\\gettext':
+            return '\\gettext{'+self._phrase(index)+'}'
+        elif name == '\\pgettext':
+            return '\\pgettext{{context {}}}{{{}}}'.format(index % 7, self._phrase(index))
+        elif name == '\\ngettext':
+            return '\\ngettext{{{0} once}}{{{0} #1 times}}{{{1}}}'.format(self._phrase(index), self._count())
+        elif name == '\\npgettext':
+            return '\\npgettext{{context {0}}}{{{1} once}}{{{1} #1 times}}{{{2}}}'.format(
+                index % 7, self._phrase(index), self._count())
+        elif name == '\\formatdate':
+            return '\\formatdate{{{}}}{{{}}}{{{}}}'.format(1+index % 28, 1+index % 12, 1990+index % 40)
+        return name
+
+    def _count(self):
+        return self.random.choice(['#1', '\\value{page}', str(self.random.randrange(100))])
+
+    def _paragraph(self, name):
+        prose = ' '.join(self.random.sample(WORDS, 8))
+        return prose+' '+self._tag(name)+'.\n\n'
+
+    def write_document(self, directory, name='document'):
+        '''Writes the document and its chapters, returns name of the root file'''
+        os.makedirs(directory, exist_ok=True)
+        names = [ i[0] for i in self.mix ]
+        weights = [ i[1] for i in self.mix ]
+        chapters = max(self.chapters, 1)
+        for chapter in range(chapters):
+            count = self.tags // chapters + (1 if chapter < self.tags % chapters else 0)
+            with open(os.path.join(directory, 'chapter{}.tex'.format(chapter)), 'w') as f:
+                f.write('\\section{{{}}}\n\n'.format(self._tag('\\gettext')))
+                for tag in self.random.choices(names, weights, k=max(count-1, 0)):
+                    f.write(self._paragraph(tag))
+        root = os.path.join(directory, name+'.tex')
+        with open(root, 'w') as f:
+            f.write('\\documentclass{article}\n\\usepackage{gettext}\n\\begin{document}\n\n')
+            for chapter in range(chapters):
+                f.write('\\input{{{}}}\n'.format(os.path.join(directory, 'chapter{}'.format(chapter))))
+            f.write('\n\\end{document}\n')
+        return root
+
+    def write_catalogs(self, document, locales):
+        '''Writes complete translations of the document, returns names of .po files'''
+        template = document.template()
+        root, _ = os.path.splitext(document.name)
+        files = []
+        for locale in locales:
+            translated = catalog.Catalog.init(template, locale)
+            translated.set_header('Content-Type', 'text/plain; charset=UTF-8')
+            for i in translated:
+                if i.plural:
+                    i.msgstr = [ '[{}:{}] {}'.format(locale, n, i.msgid_plural if n else i.msgid)
+                        for n in range(len(i.msgstr)) ]
+                else:
+                    i.msgstr = '[{}] {}'.format(locale, i.msgid)
+            files.append(root+'.'+locale+'.po')
+            translated.write(files[-1])
+        return files
+
+def generate(directory, locales, **kwargs):
+    '''Writes a synthetic document with catalogs for given locales, returns (document, .po files)'''
+    generator = Generator(**kwargs)
+    document = translator.Document(generator.write_document(directory))
+    return document, generator.write_catalogs(document, locales)
+
+def add_arguments(parser):
+    parser.add_argument('--tags', action='store', type=int, default=1000,
+        help='Number of tags in the document (default: 1000)')
+    parser.add_argument('--messages', action='store', type=int, default=None,
+        help='Number of distinct messages (default: a quarter of tags)')
+    parser.add_argument('--mix', action='store', default=DEFAULT_MIX,
+        help='Weights of tags (default: {})'.format(DEFAULT_MIX))
+    parser.add_argument('--depth', action='store', type=int, default=1,
+        help='Brace nesting depth of phrases (default: 1)')
+    parser.add_argument('--chapters', action='store', type=int, default=10,
+        help='Number of files included from the root document (default: 10)')
+    parser.add_argument('--locales', action='store', default=DEFAULT_LOCALES,
+        help='Locales of generated catalogs (default: {})'.format(DEFAULT_LOCALES))
+    parser.add_argument('--seed', action='store', type=int, default=0,
+        help='Seed of the random generator (default: 0)')
+
+def generator_arguments(args):
+    return dict(tags=args.tags, messages=args.messages, mix=args.mix, depth=args.depth,
+        chapters=args.chapters, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generator of synthetic documents and catalogs')
+    parser.add_argument('--directory', action='store', required=True,
+        help='Directory in which files are written')
+    add_arguments(parser)
+    args = parser.parse_args()
+    document, files = generate(args.directory, args.locales.split(','), **generator_arguments(args))
+    print('\n'.join([document.name]+files))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Compares TeX run time of plural rules evaluated by gettext.sty macro sets.
+
+The default set is built from \\gettextmathnand and intcalc, the [numexpr] one
+uses e-TeX \\numexpr. Run from the repository root:
+
+    python -m benchmarks.tex_backends --evaluations 5000
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import catalog
+import tex_math
+
+BACKENDS = [('default', None), ('numexpr', 'numexpr')]
+RULES = ['pl', 'ru', 'sl', 'ar']
+
+def generate_document(rules, evaluations, options=None):
+    '''Document that evaluates every rule `evaluations` times, without typesetting anything'''
+    lines = ['\\documentclass{article}']
+    lines.append('\\usepackage'+('['+options+']' if options else '')+'{gettext}')
+    for index, rule in enumerate(rules):
+        lines.append(tex_math.generate_command(tex_math._verify_command(index), rule))
+    lines.append('\\begin{document}')
+    for n in range(evaluations):
+        index = n % len(rules)
+        lines.append('\\setcounter{{_gettext_n}}{{{}{{{}}}}}'.format(tex_math._verify_command(index), n))
+    lines.append('\\end{document}')
+    return '\n'.join(lines)+'\n'
+
+def run(latex, directory, name):
+    env = dict(os.environ)
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['TEXINPUTS'] = package + os.pathsep + env.get('TEXINPUTS', '')
+    start = time.perf_counter()
+    subprocess.check_call([latex, '-interaction=nonstopmode', '-halt-on-error', name],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of gettext.sty arithmetic backends')
+    parser.add_argument('--latex', action='store', default='latex',
+        help='TeX engine to run (default: latex)')
+    parser.add_argument('--evaluations', action='store', type=int, default=3000,
+        help='Number of plural evaluations in the document (default: 3000)')
+    parser.add_argument('--repeat', action='store', type=int, default=3,
+        help='Number of runs of each document, the fastest one is reported (default: 3)')
+    parser.add_argument('--output', action='store', default=None,
+        help='Directory to keep generated documents in')
+    args = parser.parse_args()
+
+    if not shutil.which(args.latex):
+        sys.stderr.write('{} not found\n'.format(args.latex))
+        return 1
+
+    rules = [ catalog.PLURAL_FORMS[i].split(';')[1].strip()[len('plural='):] for i in RULES ]
+    with tempfile.TemporaryDirectory() as directory:
+        directory = args.output or directory
+        os.makedirs(directory, exist_ok=True)
+        print('{:>10} {:>12} {:>10}'.format('backend', 'evaluations', 'time [s]'))
+        for name, options in BACKENDS:
+            document = 'bench_'+name+'.tex'
+            with open(os.path.join(directory, document), 'w') as f:
+                f.write(generate_document(rules, args.evaluations, options))
+            elapsed = min([ run(args.latex, directory, document) for i in range(args.repeat) ])
+            print('{:>10} {:>12} {:>10.3f}'.format(name, args.evaluations, elapsed))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Micro-benchmark of tex_math.Parser over the standard gettext Plural-Forms rules.
+
+Run from the repository root:
+
+    python -m benchmarks.tex_math_parser
+'''
+
+import argparse
+import re
+import sys
+import timeit
+
+import catalog
+import tex_math
+
+def plural_rules():
+    rules = set()
+    for i in catalog.PLURAL_FORMS.values():
+        rules.add(i.split(';')[1].strip()[len('plural='):])
+    return sorted(rules, key=len)
+
+def long_rule(length):
+    '''Rule made of `length` alternatives, to show how parsing scales with expression size'''
+    return ' || '.join(['n%{}=={}'.format(i+2, i) for i in range(length)])
+
+def legacy_tokenize(source):
+    '''Tokenizer as it was before the single-pattern Parser: anchored regexes and string slicing'''
+    tokens = [ re.compile('^(?:'+i[1]+')') for i in tex_math.Parser.tokens ]
+    count = 0
+    while len(source) > 0:
+        for i in tokens:
+            m = i.match(source)
+            if m:
+                break
+        if not m:
+            raise Exception('No token matches "{}<...>"'.format(source[:10]))
+        source = source[len(m.group(0)):]
+        count += 1
+    return count
+
+def tokenize(source):
+    pos = 0
+    count = 0
+    while pos < len(source):
+        pos = tex_math.Parser.pattern.match(source, pos).end()
+        count += 1
+    return count
+
+def measure(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of plural rules parsing')
+    parser.add_argument('--number', action='store', type=int, default=200,
+        help='Number of iterations per measurement (default: 200)')
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>12}  {}'.format('length', 'parse [us]', 'eval [us]', 'rule'))
+    for rule in plural_rules():
+        parse = measure(lambda: tex_math.Parser(rule).parse(), args.number)
+        queue = tex_math.Parser(rule).parse()
+        evaluate = measure(lambda: tex_math.Generator(queue).evaluate({'n': 12}), args.number)
+        print('{:>8} {:>12.1f} {:>12.1f}  {}'.format(len(rule), parse*1e6, evaluate*1e6, rule))
+
+    print()
+    print('{:>8} {:>16} {:>16} {:>8}'.format('length', 'legacy [us]', 'current [us]', 'speedup'))
+    for length in (10, 100, 1000, 5000):
+        rule = long_rule(length)
+        number = max(args.number // length, 1)
+        legacy = measure(lambda: legacy_tokenize(rule), number)
+        current = measure(lambda: tokenize(rule), number)
+        print('{:>8} {:>16.1f} {:>16.1f} {:>8.1f}'.format(len(rule), legacy*1e6, current*1e6, legacy/current))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
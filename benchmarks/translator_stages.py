@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Times translator stages separately on a synthetic document.
+
+Stages are tag scanning (Document.find_tags), catalog loading
+(Translation._ensure_parsed, with and without a compiled catalog),
+plural conversion (convert_plurals), template generation and translation.
+Results are written as JSON together with the git revision, so that runs of
+different commits can be compared. Run from the repository root:
+
+    python -m benchmarks.translator_stages --tags 50000 --output before.json
+    python -m benchmarks.translator_stages --tags 50000 --compare before.json
+'''
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import translator
+from benchmarks import synthetic
+
+def measure(function, setup=None, repeat=5):
+    '''Best time of `repeat` runs; setup is called before every run and is not timed'''
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(document, files, repeat):
+    translations = [ translator.Translation.load(document.name, i) for i in files ]
+    document.documents()
+    tags = [ i for j in document.documents() for i in j.tags() if i.name in translator.PLURAL_TAGS ]
+    results = collections.OrderedDict()
+
+    scanned = None
+    def fresh_document():
+        nonlocal scanned
+        translator.Document._tag_cache.clear()
+        scanned = translator.Document(document.name)
+    results['find_tags'] = measure(
+        lambda: [ i.find_tags('\\gettext') for i in scanned.documents() ], fresh_document, repeat)
+
+    def remove_compiled():
+        for i in translations:
+            i.reload()
+            if os.path.exists(i.compiled_file()):
+                os.remove(i.compiled_file())
+    results['compile'] = measure(lambda: [ i._ensure_parsed() for i in translations ], remove_compiled, repeat)
+
+    def reload():
+        for i in translations:
+            i.reload()
+    results['parse'] = measure(lambda: [ i._ensure_parsed() for i in translations ], reload, repeat)
+
+    def convert_plurals():
+        for i in translations:
+            description = i.get_header('Plural-Forms')
+            nplurals = i.plural_forms().nplurals
+            for tag in tags:
+                translator.convert_plurals(description, tag.args[-1].content, [ tag.args[-2].content ] * nplurals)
+    results['convert_plurals'] = measure(convert_plurals, repeat=repeat)
+
+    results['generate_template'] = measure(lambda: translations[0].generate_template(document), repeat=repeat)
+
+    def remove_translated():
+        for i in translations:
+            for j in document.documents():
+                if os.path.exists(i.translated_name(j.name)):
+                    os.remove(i.translated_name(j.name))
+    results['translate'] = measure(lambda: [ i.translate(document) for i in translations ], remove_translated, repeat)
+    return results
+
+def compare(results, previous):
+    print('{:<20} {:>14} {:>14} {:>8}'.format('stage', previous['revision'] or 'previous', results['revision'] or 'current', 'ratio'))
+    for stage, seconds in results['results'].items():
+        before = previous['results'].get(stage)
+        if before is None:
+            print('{:<20} {:>14} {:>14.4f}'.format(stage, '-', seconds))
+        else:
+            print('{:<20} {:>14.4f} {:>14.4f} {:>8.2f}'.format(stage, before, seconds, seconds/before))
+    if previous['parameters'] != results['parameters']:
+        print('warning: runs used different parameters')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of translator stages on a synthetic document')
+    synthetic.add_arguments(parser)
+    parser.add_argument('--repeat', action='store', type=int, default=5,
+        help='Number of runs of every stage, the best one is reported (default: 5)')
+    parser.add_argument('--output', action='store', default=None,
+        help='Write results as JSON to given file')
+    parser.add_argument('--compare', action='store', default=None,
+        help='Compare results with a JSON file written by a previous run')
+    args = parser.parse_args()
+
+    translator.set_today(datetime.date(2012, 12, 21))
+    stderr = sys.stderr
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            document, files = synthetic.generate(directory, args.locales.split(','), **synthetic.generator_arguments(args))
+            timings = run(document, files, args.repeat)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+            os.chdir(cwd)
+
+    parameters = synthetic.generator_arguments(args)
+    parameters['locales'] = args.locales
+    results = collections.OrderedDict([
+        ('revision', revision()),
+        ('python', platform.python_version()),
+        ('parameters', parameters),
+        ('repeat', args.repeat),
+        ('results', timings),
+    ])
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    else:
+        for stage, seconds in timings.items():
+            print('{:<20} {:>10.4f} s'.format(stage, seconds))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+            f.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
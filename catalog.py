@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import mmap
+import os
+import re
+import struct
+import tempfile
+import unittest
+
+PAGE_WIDTH = 79
+DEFAULT_NPLURALS = 2
+
+RE_KEYWORD = re.compile(r'^(msgctxt|msgid_plural|msgid|msgstr(?:\[([0-9]+)\])?)\s+(".*")\s*$')
+RE_STRING = re.compile(r'^(".*")\s*$')
+RE_NPLURALS = re.compile(r'nplurals\s*=\s*([0-9]+)')
+
+MO_MAGIC = 0x950412de
+MO_HEADER = struct.Struct('<7I')
+MO_ENTRY = struct.Struct('<2I')
+MO_CONTEXT_GLUE = b'\x04'
+
+# Plural-Forms used by msginit for the most common languages
+PLURAL_FORMS = {
+	'ar': 'nplurals=6; plural=n==0 ? 0 : n==1 ? 1 : n==2 ? 2 : n%100>=3 && n%100<=10 ? 3 : n%100>=11 ? 4 : 5;',
+	'cs': 'nplurals=3; plural=(n==1) ? 0 : (n>=2 && n<=4) ? 1 : 2;',
+	'da': 'nplurals=2; plural=(n != 1);',
+	'de': 'nplurals=2; plural=(n != 1);',
+	'en': 'nplurals=2; plural=(n != 1);',
+	'es': 'nplurals=2; plural=(n != 1);',
+	'fi': 'nplurals=2; plural=(n != 1);',
+	'fr': 'nplurals=2; plural=(n > 1);',
+	'ga': 'nplurals=3; plural=n==1 ? 0 : n==2 ? 1 : 2;',
+	'hu': 'nplurals=2; plural=(n != 1);',
+	'it': 'nplurals=2; plural=(n != 1);',
+	'ja': 'nplurals=1; plural=0;',
+	'ko': 'nplurals=1; plural=0;',
+	'lt': 'nplurals=3; plural=(n%10==1 && n%100!=11 ? 0 : n%10>=2 && (n%100<10 || n%100>=20) ? 1 : 2);',
+	'lv': 'nplurals=3; plural=(n%10==1 && n%100!=11 ? 0 : n != 0 ? 1 : 2);',
+	'nb': 'nplurals=2; plural=(n != 1);',
+	'nl': 'nplurals=2; plural=(n != 1);',
+	'pl': 'nplurals=3; plural=(n==1 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2);',
+	'pt': 'nplurals=2; plural=(n != 1);',
+	'pt_BR': 'nplurals=2; plural=(n > 1);',
+	'ro': 'nplurals=3; plural=n==1 ? 0 : (n==0 || (n%100 > 0 && n%100 < 20)) ? 1 : 2;',
+	'ru': 'nplurals=3; plural=(n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2);',
+	'sk': 'nplurals=3; plural=(n==1) ? 0 : (n>=2 && n<=4) ? 1 : 2;',
+	'sl': 'nplurals=4; plural=(n%100==1 ? 0 : n%100==2 ? 1 : n%100==3 || n%100==4 ? 2 : 3);',
+	'sv': 'nplurals=2; plural=(n != 1);',
+	'tr': 'nplurals=2; plural=(n > 1);',
+	'uk': 'nplurals=3; plural=(n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2);',
+	'zh': 'nplurals=1; plural=0;',
+}
+
+ESCAPES = {
+	'\\': '\\\\',
+	'"': '\\"',
+	'\n': '\\n',
+	'\t': '\\t',
+	'\r': '\\r',
+}
+UNESCAPES = { v[1]: k for k, v in ESCAPES.items() }
+
+def escape(s):
+	return ''.join([ ESCAPES.get(i, i) for i in s ])
+
+def unescape(s):
+	return re.sub(r'\\(.)', lambda m: UNESCAPES.get(m.group(1), m.group(1)), s)
+
+def plural_forms(locale):
+	return PLURAL_FORMS.get(locale, PLURAL_FORMS.get(locale.split('_')[0], None))
+
+def nplurals(plural_forms):
+	m = RE_NPLURALS.search(plural_forms or '')
+	return int(m.group(1)) if m else DEFAULT_NPLURALS
+
+class Message:
+	def __init__(self, msgid, msgstr=None, msgctxt=None, msgid_plural=None,
+			comments=None, extracted=None, references=None, flags=None,
+			previous=None, obsolete=False):
+		self.msgid = msgid
+		self.msgctxt = msgctxt
+		self.msgid_plural = msgid_plural
+		if msgstr is None:
+			msgstr = ['', ''] if msgid_plural is not None else ''
+		self.msgstr = msgstr
+		self.comments = comments or []
+		self.extracted = extracted or []
+		self.references = references or []
+		self.flags = flags or []
+		self.previous = previous or []
+		self.obsolete = obsolete
+
+	@property
+	def key(self):
+		return (self.msgid, self.msgctxt)
+
+	@property
+	def plural(self):
+		return self.msgid_plural is not None
+
+	def _fields(self):
+		return (self.msgid, self.msgctxt, self.msgid_plural, self.msgstr, self.comments,
+			self.extracted, self.references, self.flags, self.previous, self.obsolete)
+
+	def __eq__(self, other):
+		return isinstance(other, Message) and self._fields() == other._fields()
+
+	def __repr__(self):
+		return 'Message(msgid={!r}, msgctxt={!r})'.format(self.msgid, self.msgctxt)
+
+def hash_string(s):
+	'''hashpjw, as used by GNU gettext for .mo hash tables'''
+	hval = 0
+	for i in s:
+		hval = ((hval << 4) + i) & 0xffffffff
+		g = hval & 0xf0000000
+		if g:
+			hval ^= g >> 24
+			hval ^= g
+	return hval
+
+def next_prime(n):
+	n |= 1
+	while any([ n % i == 0 for i in range(3, int(n ** 0.5)+1, 2) ]):
+		n += 2
+	return n
+
+def _mo_key(msgid, msgctxt):
+	key = msgid.encode('utf-8')
+	if msgctxt is not None:
+		key = msgctxt.encode('utf-8')+MO_CONTEXT_GLUE+key
+	return key
+
+def _format_string(keyword, value, prefix=''):
+	line = prefix+keyword+' "'+escape(value)+'"'
+	segments = [ i for i in re.split('(?<=\n)', value) if i ]
+	if len(segments) <= 1 and len(line) <= PAGE_WIDTH:
+		return [line]
+	width = PAGE_WIDTH-len(prefix)-2
+	lines = [prefix+keyword+' ""']
+	for segment in segments:
+		line = ''
+		for word in re.findall(r'[^ ]*(?: +|$)', escape(segment)):
+			if line and len(line)+len(word) > width:
+				lines.append(prefix+'"'+line+'"')
+				line = ''
+			line += word
+		if line:
+			lines.append(prefix+'"'+line+'"')
+	return lines
+
+def _format_references(references):
+	lines = []
+	line = '#:'
+	for i in references:
+		if len(line) > 2 and len(line)+1+len(i) > PAGE_WIDTH:
+			lines.append(line)
+			line = '#:'
+		line += ' '+i
+	if len(line) > 2:
+		lines.append(line)
+	return lines
+
+class Catalog:
+	def __init__(self):
+		self.messages = collections.OrderedDict()
+		self.obsolete = collections.OrderedDict()
+
+	def add(self, message):
+		messages = self.obsolete if message.obsolete else self.messages
+		if message.key in messages:
+			raise Exception('Key already exists: '+repr(message.key))
+		messages[message.key] = message
+
+	def __getitem__(self, key):
+		return self.messages[key]
+
+	def __contains__(self, key):
+		return key in self.messages
+
+	def __iter__(self):
+		return iter([ i for i in self.messages.values() if i.msgid or i.msgctxt is not None ])
+
+	def __len__(self):
+		return len(list(iter(self)))
+
+	def __eq__(self, other):
+		return (isinstance(other, Catalog) and
+			list(self.messages.values()) == list(other.messages.values()) and
+			list(self.obsolete.values()) == list(other.obsolete.values()))
+
+	def header_entry(self):
+		return self.messages.get(('', None), None)
+
+	def header(self):
+		header = collections.OrderedDict()
+		entry = self.header_entry()
+		if entry:
+			for i in entry.msgstr.split('\n'):
+				sep = i.find(':')
+				key = i[:sep].strip()
+				value = i[sep+1:].strip()
+				if key:
+					header[key] = value
+		return header
+
+	def set_header(self, key, value):
+		entry = self.header_entry()
+		lines = [ i for i in entry.msgstr.split('\n') if i ]
+		for n, i in enumerate(lines):
+			if i.split(':', 1)[0].strip() == key:
+				lines[n] = key+': '+value
+				break
+		else:
+			lines.append(key+': '+value)
+		entry.msgstr = '\n'.join(lines)+'\n'
+
+	def nplurals(self):
+		return nplurals(self.header().get('Plural-Forms', None))
+
+	def fingerprint(self):
+		'''Digest of the message set: context, identifier and plural identifier of messages, in order'''
+		digest = hashlib.sha1()
+		for i in self:
+			for field in (i.msgctxt, i.msgid, i.msgid_plural):
+				digest.update(b'\1\0' if field is None else field.encode('utf-8')+b'\0')
+		return digest.hexdigest()
+
+	def merge(self, template):
+		'''Merges template into this catalog the way msgmerge does (without fuzzy matching)'''
+		result = Catalog()
+		header = self.header_entry() or template.header_entry()
+		if header:
+			result.add(Message(header.msgid, header.msgstr, comments=list(header.comments),
+				flags=list(header.flags)))
+		n = self.nplurals()
+		for i in template:
+			old = self.messages.get(i.key, None) or self.obsolete.get(i.key, None)
+			if old is None:
+				result.add(Message(i.msgid, [''] * n if i.plural else '', i.msgctxt, i.msgid_plural,
+					extracted=list(i.extracted), references=list(i.references), flags=list(i.flags)))
+				continue
+			msgstr = old.msgstr
+			flags = list(old.flags)
+			for flag in i.flags:
+				if flag not in flags:
+					flags.append(flag)
+			if i.plural != old.plural:
+				if i.plural:
+					msgstr = [msgstr]+[''] * (n-1)
+				else:
+					msgstr = msgstr[0]
+				if 'fuzzy' not in flags:
+					flags.insert(0, 'fuzzy')
+			result.add(Message(i.msgid, msgstr, i.msgctxt, i.msgid_plural,
+				comments=list(old.comments), extracted=list(i.extracted),
+				references=list(i.references), flags=flags, previous=list(old.previous)))
+		for i in list(self) + list(self.obsolete.values()):
+			if i.key not in result.messages and i.key not in result.obsolete:
+				result.add(Message(i.msgid, i.msgstr, i.msgctxt, i.msgid_plural,
+					comments=list(i.comments), flags=list(i.flags), obsolete=True))
+		return result
+
+	@staticmethod
+	def init(template, locale):
+		'''Creates new translation catalog from template, like msginit does'''
+		result = Catalog()
+		header = template.header_entry()
+		result.add(Message('', header.msgstr if header else ''))
+		result.set_header('Language', locale)
+		rule = plural_forms(locale)
+		if rule:
+			result.set_header('Plural-Forms', rule)
+		n = result.nplurals()
+		for i in template:
+			result.add(Message(i.msgid, [''] * n if i.plural else '', i.msgctxt, i.msgid_plural,
+				extracted=list(i.extracted), references=list(i.references), flags=list(i.flags)))
+		return result
+
+	def format(self):
+		entries = []
+		for i in list(self.messages.values())+list(self.obsolete.values()):
+			lines = []
+			lines += [ '# '+c if c else '#' for c in i.comments ]
+			lines += [ '#. '+c for c in i.extracted ]
+			lines += _format_references(i.references)
+			if i.flags:
+				lines.append('#, '+', '.join(i.flags))
+			lines += i.previous
+			prefix = '#~ ' if i.obsolete else ''
+			if i.msgctxt is not None:
+				lines += _format_string('msgctxt', i.msgctxt, prefix)
+			lines += _format_string('msgid', i.msgid, prefix)
+			if i.plural:
+				lines += _format_string('msgid_plural', i.msgid_plural, prefix)
+				for n, s in enumerate(i.msgstr):
+					lines += _format_string('msgstr[{}]'.format(n), s, prefix)
+			else:
+				lines += _format_string('msgstr', i.msgstr, prefix)
+			entries.append('\n'.join(lines)+'\n')
+		return '\n'.join(entries)
+
+	def write(self, file):
+		with open(file, 'w', encoding='utf-8') as f:
+			f.write(self.format())
+
+	def write_mo(self, file):
+		'''Compiles catalog into binary file laid out like GNU .mo, with hash table'''
+		entries = []
+		for i in self.messages.values():
+			original = _mo_key(i.msgid, i.msgctxt)
+			if i.plural:
+				original += b'\0'+i.msgid_plural.encode('utf-8')
+				translation = b'\0'.join([ s.encode('utf-8') for s in i.msgstr ])
+			else:
+				translation = i.msgstr.encode('utf-8')
+			entries.append((original, translation))
+		entries.sort()
+
+		n = len(entries)
+		size = next_prime(max(n * 4 // 3, 3))
+		table = [0] * size
+		for index, (original, _) in enumerate(entries):
+			hval = hash_string(original.split(b'\0', 1)[0])
+			idx = hval % size
+			incr = 1 + hval % (size-2)
+			while table[idx]:
+				idx = idx-(size-incr) if idx >= size-incr else idx+incr
+			table[idx] = index+1
+
+		originals_offset = MO_HEADER.size
+		translations_offset = originals_offset + n * MO_ENTRY.size
+		hash_offset = translations_offset + n * MO_ENTRY.size
+		offset = hash_offset + size * 4
+		originals = []
+		translations = []
+		data = []
+		for target, column in ((originals, 0), (translations, 1)):
+			for i in entries:
+				target.append(MO_ENTRY.pack(len(i[column]), offset))
+				data.append(i[column]+b'\0')
+				offset += len(i[column])+1
+
+		directory = os.path.dirname(os.path.abspath(file))
+		with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+			f.write(MO_HEADER.pack(MO_MAGIC, 0, n, originals_offset, translations_offset, size, hash_offset))
+			f.write(b''.join(originals))
+			f.write(b''.join(translations))
+			f.write(struct.pack('<{}I'.format(size), *table))
+			f.write(b''.join(data))
+		os.replace(f.name, file)
+
+	@staticmethod
+	def parse(lines):
+		catalog = Catalog()
+		entry = {}
+		strings = None
+
+		def join(strings):
+			return ''.join([ unescape(i[1:-1]) for i in strings ]) if strings is not None else None
+
+		def flush():
+			nonlocal entry, strings
+			if 'msgid' in entry:
+				msgstr = join(entry.get('msgstr', ['""']))
+				if 'msgid_plural' in entry:
+					plurals = entry.get('msgstr[]', {})
+					msgstr = [ join(plurals[n]) for n in sorted(plurals) ]
+				catalog.add(Message(join(entry['msgid']), msgstr, join(entry.get('msgctxt', None)),
+					join(entry.get('msgid_plural', None)), entry.get('comments', None),
+					entry.get('extracted', None), entry.get('references', None),
+					entry.get('flags', None), entry.get('previous', None),
+					entry.get('obsolete', False)))
+			entry = {}
+			strings = None
+
+		for line in lines:
+			line = line.rstrip('\n')
+			if line.startswith('#~|'):
+				entry.setdefault('previous', []).append(line)
+				continue
+			obsolete = line.startswith('#~')
+			if obsolete:
+				line = line[2:].lstrip()
+			if not line.strip():
+				flush()
+				continue
+			if line.startswith('#'):
+				if 'msgid' in entry:
+					flush()
+				if line.startswith('#,'):
+					entry.setdefault('flags', []).extend(
+						[ i.strip() for i in line[2:].split(',') if i.strip() ])
+				elif line.startswith('#:'):
+					entry.setdefault('references', []).extend(line[2:].split())
+				elif line.startswith('#.'):
+					entry.setdefault('extracted', []).append(line[2:].strip())
+				elif line.startswith('#|'):
+					entry.setdefault('previous', []).append(line)
+				else:
+					entry.setdefault('comments', []).append(line[2:] if line.startswith('# ') else line[1:])
+				continue
+			m = RE_KEYWORD.match(line)
+			if m:
+				keyword, index, value = m.groups()
+				if keyword in ('msgctxt', 'msgid') and ('msgstr' in entry or 'msgstr[]' in entry):
+					flush()
+				if obsolete:
+					entry['obsolete'] = True
+				strings = [value]
+				if index is not None:
+					entry.setdefault('msgstr[]', {})[int(index)] = strings
+				else:
+					entry[keyword] = strings
+				continue
+			m = RE_STRING.match(line)
+			if m and strings is not None:
+				strings.append(m.group(1))
+				continue
+			raise Exception('Could not parse line: '+repr(line))
+		flush()
+		return catalog
+
+	@staticmethod
+	def loads(text):
+		return Catalog.parse(text.splitlines())
+
+	@staticmethod
+	def read(file):
+		with open(file, encoding='utf-8') as f:
+			return Catalog.parse(f)
+
+class CompiledCatalog:
+	'''Read-only catalog backed by memory-mapped .mo file'''
+	def __init__(self, file):
+		self.file = file
+		with open(file, 'rb') as f:
+			self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		(magic, _, self._n, self._originals, self._translations,
+			self._hash_size, self._hash_offset) = MO_HEADER.unpack_from(self._data, 0)
+		if magic != MO_MAGIC:
+			raise Exception('File "{}" is not a compiled catalog'.format(file))
+
+	@staticmethod
+	def up_to_date(file, source):
+		return os.path.exists(file) and os.stat(file).st_mtime_ns >= os.stat(source).st_mtime_ns
+
+	def _string(self, table, index):
+		length, offset = MO_ENTRY.unpack_from(self._data, table + index * MO_ENTRY.size)
+		return self._data[offset:offset+length]
+
+	def _find(self, key):
+		if self._hash_size <= 2:
+			return None
+		hval = hash_string(key)
+		idx = hval % self._hash_size
+		incr = 1 + hval % (self._hash_size-2)
+		while True:
+			index, = struct.unpack_from('<I', self._data, self._hash_offset + idx * 4)
+			if not index:
+				return None
+			original = self._string(self._originals, index-1)
+			if original.split(b'\0', 1)[0] == key:
+				return index-1, original
+			idx = idx-(self._hash_size-incr) if idx >= self._hash_size-incr else idx+incr
+
+	def get(self, key, default=None):
+		msgid, msgctxt = key
+		found = self._find(_mo_key(msgid, msgctxt))
+		if found is None:
+			return default
+		index, original = found
+		translation = self._string(self._translations, index).decode('utf-8')
+		original = original.split(b'\0', 1)
+		if len(original) > 1:
+			return Message(msgid, translation.split('\0'), msgctxt, original[1].decode('utf-8'))
+		return Message(msgid, translation, msgctxt)
+
+	def __getitem__(self, key):
+		message = self.get(key)
+		if message is None:
+			raise KeyError(key)
+		return message
+
+	def __contains__(self, key):
+		return self.get(key) is not None
+
+	def __len__(self):
+		return self._n - int(('', None) in self)
+
+	def header(self):
+		return Catalog.header(self)
+
+	def header_entry(self):
+		return self.get(('', None))
+
+	def close(self):
+		self._data.close()
+
+class TestCatalog(unittest.TestCase):
+	EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
+
+	def _template(self):
+		template = Catalog()
+		template.add(Message('', 'Content-Type: text/plain; charset=UTF-8\n'))
+		template.add(Message('There is one sandwich on the table',
+			msgid_plural='There are #1 sandwiches on the table'))
+		template.add(Message('One mercury brings mercury onto Mercury',
+			msgctxt='first mercury is a person, second is substance, third is planet',
+			msgid_plural='#1 mercuries bring mercury onto Mercury'))
+		template.add(Message('Hello world!'))
+		return template
+
+	def test_roundtrip(self):
+		for i in ('sample_doc.de_DE.po', 'sample_doc.pl_PL.po'):
+			with open(os.path.join(self.EXAMPLES, i), encoding='utf-8') as f:
+				expected = f.read().rstrip('\n')+'\n'
+			catalog = Catalog.read(os.path.join(self.EXAMPLES, i))
+			self.assertEqual(expected, catalog.format())
+			merged = catalog.merge(self._template())
+			self.assertEqual(catalog, merged)
+			self.assertEqual(expected, merged.format())
+
+	def test_parse(self):
+		catalog = Catalog.read(os.path.join(self.EXAMPLES, 'sample_doc.pl_PL.po'))
+		self.assertEqual(3, len(catalog))
+		self.assertEqual('nplurals=3; plural=(n==1 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2);',
+			catalog.header()['Plural-Forms'])
+		self.assertEqual(3, catalog.nplurals())
+		self.assertEqual('Witaj świecie!', catalog[('Hello world!', None)].msgstr)
+		self.assertEqual(3, len(catalog[('There is one sandwich on the table', None)].msgstr))
+
+	def test_merge(self):
+		catalog = Catalog.parse([
+			'# comment\n',
+			'msgid ""\n',
+			'msgstr "Plural-Forms: nplurals=3; plural=n==1 ? 0 : n==2 ? 1 : 2;\\n"\n',
+			'\n',
+			'# keep me\n',
+			'msgid "\\\\gettext"\n',
+			'msgstr "\\\\translated \\"quoted\\""\n',
+			'\n',
+			'msgid "gone"\n',
+			'msgstr "away"\n',
+		])
+		template = Catalog()
+		template.add(Message('', ''))
+		template.add(Message('new', msgid_plural='news'))
+		template.add(Message('\\gettext', references=['doc.tex:3']))
+		merged = catalog.merge(template)
+		self.assertNotEqual(catalog, merged)
+		self.assertEqual(merged, merged.merge(template))
+		self.assertEqual('\n'.join([
+			'# comment',
+			'msgid ""',
+			'msgstr "Plural-Forms: nplurals=3; plural=n==1 ? 0 : n==2 ? 1 : 2;\\n"',
+			'',
+			'msgid "new"',
+			'msgid_plural "news"',
+			'msgstr[0] ""',
+			'msgstr[1] ""',
+			'msgstr[2] ""',
+			'',
+			'# keep me',
+			'#: doc.tex:3',
+			'msgid "\\\\gettext"',
+			'msgstr "\\\\translated \\"quoted\\""',
+			'',
+			'#~ msgid "gone"',
+			'#~ msgstr "away"',
+			''
+		]), merged.format())
+		self.assertEqual(merged, Catalog.parse(merged.format().splitlines()))
+
+	def test_init(self):
+		catalog = Catalog.init(self._template(), 'pl_PL')
+		self.assertEqual('pl_PL', catalog.header()['Language'])
+		self.assertEqual(3, catalog.nplurals())
+		self.assertEqual(['', '', ''], catalog[('There is one sandwich on the table', None)].msgstr)
+
+	def test_fingerprint(self):
+		template = self._template()
+		fingerprint = template.fingerprint()
+		for i in template:
+			i.references = ['doc.tex:1']
+			i.msgstr = 'changed'
+		template.header_entry().msgstr = ''
+		self.assertEqual(fingerprint, template.fingerprint())
+		template.add(Message('There is one sandwich on the table', msgctxt=''))
+		self.assertNotEqual(fingerprint, template.fingerprint())
+
+	def test_compiled(self):
+		catalog = Catalog.read(os.path.join(self.EXAMPLES, 'sample_doc.pl_PL.po'))
+		for i in range(200):
+			catalog.add(Message('message {}'.format(i), 'translation {}'.format(i), msgctxt='ctx' if i % 2 else None))
+		with tempfile.TemporaryDirectory() as directory:
+			name = os.path.join(directory, 'catalog.mo')
+			catalog.write_mo(name)
+			compiled = CompiledCatalog(name)
+			self.assertEqual(len(catalog), len(compiled))
+			self.assertEqual(catalog.header(), compiled.header())
+			for i in catalog:
+				self.assertEqual((i.msgid, i.msgctxt, i.msgid_plural, i.msgstr),
+					(lambda m: (m.msgid, m.msgctxt, m.msgid_plural, m.msgstr))(compiled[i.key]))
+			self.assertNotIn(('message 1', None), compiled)
+			self.assertNotIn(('missing', None), compiled)
+			compiled.close()
+
+	def test_wrap(self):
+		lines = _format_string('msgid', 'word '*20)
+		self.assertEqual('msgid ""', lines[0])
+		self.assertTrue(all([ len(i) <= PAGE_WIDTH for i in lines ]))
+		self.assertEqual('word '*20, ''.join([ i[1:-1] for i in lines[1:] ]))
+
+if __name__ == '__main__':
+	unittest.main()
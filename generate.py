@@ -2,7 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import logging
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import datetime
+import glob
+import hashlib
+import json
 import os
 import os.path
 import re
@@ -11,30 +18,609 @@ import subprocess
 import sys
 import time
 import translator
+import unittest
+
+try:
+	import inotify_simple
+except ImportError:
+	inotify_simple = None
 
 VERSION='0.1'
 
-logging.basicConfig(level=logging.DEBUG)
+class BuildCache:
+	def __init__(self, input):
+		root, _ = os.path.splitext(input)
+		self.name = root+'.cache.sqlite'
+		self._db = sqlite3.connect(self.name)
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS builds ('+
+				'locale TEXT PRIMARY KEY, digest TEXT NOT NULL, output TEXT NOT NULL)')
+			columns = [ i[1] for i in self._db.execute('PRAGMA table_info(merges)') ]
+			if columns and 'digest' not in columns:
+				self._db.execute('DROP TABLE merges') #written by an older version
+			self._db.execute('CREATE TABLE IF NOT EXISTS merges ('+
+				'locale TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, digest TEXT NOT NULL)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS templates ('+
+				'name TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)')
+
+	def digest(self, locale):
+		row = self._db.execute('SELECT digest FROM builds WHERE locale = ?', (locale,)).fetchone()
+		return row[0] if row else None
+
+	def record(self, locale, digest, output):
+		with self._db:
+			self._db.execute('INSERT OR REPLACE INTO builds (locale, digest, output) VALUES (?, ?, ?)',
+				(locale, digest, output))
+
+	def merge(self, locale):
+		'''Template fingerprint and .po file digest recorded at the last merge, or None'''
+		return self._db.execute('SELECT fingerprint, digest FROM merges WHERE locale = ?', (locale,)).fetchone()
+
+	def record_merge(self, locale, fingerprint, digest):
+		with self._db:
+			self._db.execute('INSERT OR REPLACE INTO merges (locale, fingerprint, digest) VALUES (?, ?, ?)',
+				(locale, fingerprint, digest))
+
+	def template(self, name):
+		'''Fingerprint of messages last written to the template file, or None'''
+		row = self._db.execute('SELECT fingerprint FROM templates WHERE name = ?', (name,)).fetchone()
+		return row[0] if row else None
+
+	def record_template(self, name, fingerprint):
+		with self._db:
+			self._db.execute('INSERT OR REPLACE INTO templates (name, fingerprint) VALUES (?, ?)',
+				(name, fingerprint))
+
+	def close(self):
+		self._db.close()
+
+class Timings:
+	'''Wall and CPU time of build stages; CPU time of child processes (TeX) is counted separately'''
+	TEX_STAGES = ('xelatex',)
+
+	def __init__(self, profile=None):
+		self.records = []
+		self.profile = profile
+		self._start = time.perf_counter()
+
+	@contextlib.contextmanager
+	def stage(self, stage, locale=None):
+		record = collections.OrderedDict([ ('stage', stage), ('locale', locale) ])
+		wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+		profile = self.profile and stage not in self.TEX_STAGES
+		if profile:
+			self.profile.enable()
+		try:
+			yield record
+		finally:
+			if profile:
+				self.profile.disable()
+			record['wall'] = time.perf_counter()-wall
+			record['cpu'] = time.process_time()-cpu
+			record['children_cpu'] = _children_cpu()-children
+			self.records.append(record)
+
+	def report(self, **info):
+		report = collections.OrderedDict(info)
+		report['wall'] = time.perf_counter()-self._start
+		totals = collections.OrderedDict()
+		for i in self.records:
+			for key in ('tex' if i['stage'] in self.TEX_STAGES else 'python', i['stage']):
+				total = totals.setdefault(key, collections.OrderedDict([ ('wall', 0.0), ('cpu', 0.0), ('count', 0) ]))
+				total['wall'] += i['wall']
+				total['cpu'] += i['cpu']+i['children_cpu']
+				total['count'] += 1
+		report['passes'] = sum([ i.get('passes', 0) for i in self.records ])
+		report['totals'] = totals
+		report['stages'] = self.records
+		return report
+
+	def write_summary(self, file=sys.stderr):
+		report = self.report()
+		for i in self.records:
+			file.write('{:<10} {:<8} wall {:8.3f}s  cpu {:8.3f}s\n'.format(
+				i['stage'], i['locale'] or '', i['wall'], i['cpu']+i['children_cpu']))
+		for stage, total in report['totals'].items():
+			file.write('{:<19} wall {:8.3f}s  cpu {:8.3f}s  ({} runs)\n'.format(
+				stage+' total', total['wall'], total['cpu'], total['count']))
+		file.write('TeX passes: {}, total wall time: {:.3f}s\n'.format(report['passes'], report['wall']))
 
-def generate(input, languages=None):
+def _children_cpu():
+	times = os.times()
+	return times.children_user+times.children_system
+
+def find_package(input):
+	for i in (os.path.dirname(input), os.path.dirname(os.path.abspath(__file__))):
+		name = os.path.join(i, 'gettext.sty')
+		if os.path.exists(name):
+			return name
+	return None
+
+def file_digest(name):
+	if not name or not os.path.exists(name):
+		return ''
+	with open(name, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def build_digest(document, translation, translated):
+	digest = hashlib.sha1()
+	for i in [ i.digest() for i in document.documents() ]+[ file_digest(translation.file),
+			file_digest(find_package(document.name)), file_digest(translated.name) ]:
+		digest.update(i.encode('ascii')+b'\0')
+	return digest.hexdigest()
+
+def build(document, translation, output_directory=None, digest=None, timings=None):
+	timings = timings or Timings()
+	with timings.stage('parse', translation.locale):
+		translation.parse()
+	with timings.stage('translate', translation.locale):
+		translated = translation.translate(document)
+	new_digest = build_digest(document, translation, translated)
+	output = translated.output(output_directory)
+	if new_digest == digest and os.path.exists(output):
+		sys.stderr.write('{} is up to date\n'.format(output))
+		return output, new_digest
+	with timings.stage('xelatex', translation.locale) as record:
+		record['passes'] = 1
+		output = translated.generate(output_directory)
+	return output, new_digest
+
+def _build_job(input, locale, file, document, output_directory, digest):
+	timings = Timings()
+	output, digest = build(document, translator.Translation(input, locale, file), output_directory, digest, timings)
+	return output, digest, timings.records
+
+def load(input, languages=None, timings=None):
+	timings = timings or Timings()
 	document = translator.Document.load(input)
+	with timings.stage('scan'):
+		document.documents()
 	translations = [translator.Translation(input, 'en_US')]+translator.find_translations(input, languages=languages.split(',') if languages else None)
-	changed = False
-	for i in translations:
-		if i.update(document):
-			changed = True
+	return document, translations
+
+def update(input, document, translations, timings=None):
+	timings = timings or Timings()
+	with timings.stage('template'):
+		template = document.template()
+	return update_catalogs(input, document, template, document.template_name(), translations, timings)
+
+def update_catalogs(input, document, template, template_name, translations, timings=None):
+	timings = timings or Timings()
+	fingerprint = template.fingerprint()
+	cache = BuildCache(input)
+	try:
+		#a .po file replaced since the last merge (checkout, sync) may lack messages
+		stale = [ i for i in translations if i.file and (not os.path.exists(i.file) or
+			cache.merge(i.locale) != (fingerprint, file_digest(i.file))) ]
+		if not stale and os.path.exists(template_name) and cache.template(template_name) == fingerprint:
+			sys.stderr.write('Messages have not changed, skipping update of translations\n')
+			return False
+		sys.stderr.write('Generating template "{}"...\n'.format(template_name))
+		with timings.stage('write-template'):
+			template.write(template_name)
+		cache.record_template(template_name, fingerprint)
+		changed = False
+		for i in stale:
+			with timings.stage('merge', i.locale):
+				if i.update(document, template):
+					changed = True
+			cache.record_merge(i.locale, fingerprint, file_digest(i.file))
+		return changed
+	finally:
+		cache.close()
 
-	if changed:
-		sys.stderr.write('Some translations has changed. Please update them and restart the process\n')
-		sys.exit(1)
+def build_all(input, document, translations, jobs=1, timings=None):
+	timings = timings or Timings()
+	cache = BuildCache(input)
+	outputs = {}
+	digests = {}
+	failures = {}
+	today = datetime.date.today()
+	translator.set_today(today)
+	if jobs > 1:
+		root, _ = os.path.splitext(input)
+		locales = [ i.locale for i in translations ] if translator.uses_dates(document.documents()) else []
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=translator.initialize_worker,
+				initargs=(locales, today)) as executor:
+			futures = {}
+			for i in translations:
+				output_directory = os.path.join(root+'.build', i.locale)
+				future = executor.submit(_build_job, input, i.locale, i.file, document,
+					output_directory, cache.digest(i.locale))
+				futures[future] = i.locale
+			for future in concurrent.futures.as_completed(futures):
+				locale = futures[future]
+				try:
+					outputs[locale], digests[locale], records = future.result()
+					timings.records += records
+				except Exception as e:
+					failures[locale] = e
+	else:
+		for i in translations:
+			try:
+				outputs[i.locale], digests[i.locale] = build(document, i, digest=cache.digest(i.locale), timings=timings)
+			except Exception as e:
+				failures[i.locale] = e
 
-	outputs = []
+	for locale, output in outputs.items():
+		cache.record(locale, digests[locale], output)
+	cache.close()
+	return outputs, failures
+
+def report_failures(failures):
+	for locale, e in sorted(failures.items()):
+		sys.stderr.write('Building {} failed: {}\n'.format(locale, e))
+
+def open_outputs(translations, outputs):
 	for i in translations:
-		i = i.translate(document)
-		outputs.append(i.generate())
+		if i.locale in outputs:
+			subprocess.check_call(['xdg-open', outputs[i.locale]])
+
+def generate(input, languages=None, jobs=1, profile=False, timings_json=None, profile_dump=None):
+	timings = Timings(cProfile.Profile() if profile_dump else None)
+	try:
+		document, translations = load(input, languages, timings)
+		if update(input, document, translations, timings):
+			sys.stderr.write('Some translations has changed. Please update them and restart the process\n')
+			sys.exit(1)
+
+		outputs, failures = build_all(input, document, translations, jobs, timings)
+		open_outputs(translations, outputs)
+		if failures:
+			report_failures(failures)
+			sys.exit(1)
+	finally:
+		write_timings(timings, input, jobs, profile, timings_json, profile_dump)
+
+def extract(input, profile=False, timings_json=None, profile_dump=None):
+	timings = Timings(cProfile.Profile() if profile_dump else None)
+	try:
+		document = translator.Document.load(input)
+		with timings.stage('scan'):
+			document.documents()
+		with timings.stage('template'):
+			template = document.template()
+		template_name = document.template_name()
+		sys.stderr.write('Generating template "{}"...\n'.format(template_name))
+		with timings.stage('write-template'):
+			template.write(template_name)
+		return template_name
+	finally:
+		write_timings(timings, input, 1, profile, timings_json, profile_dump)
+
+def write_timings(timings, input, jobs, profile=False, timings_json=None, profile_dump=None):
+	if profile:
+		timings.write_summary()
+	if timings_json:
+		with open(timings_json, 'w') as f:
+			json.dump(timings.report(input=input, jobs=jobs), f, indent='\t')
+			f.write('\n')
+	if profile_dump:
+		timings.profile.dump_stats(profile_dump)
+
+def read_manifest(name):
+	'''Reads manifest lines "<document> [<catalog root>]"; # starts a comment'''
+	entries = []
+	with open(name) as f:
+		for line in f:
+			fields = line.split('#', 1)[0].split()
+			if fields:
+				entries.append((fields[0], fields[1] if len(fields) > 1 else None))
+	return entries
+
+def find_documents(patterns):
+	'''Documents matching glob patterns, without translated copies of other matched documents'''
+	names = set([ i for pattern in patterns for i in glob.glob(pattern, recursive=True) ])
+	translated = re.compile(r'^(.*)\.[^./]+(\.tex)$')
+	return [ (i, None) for i in sorted(names)
+		if not (translated.match(i) and translated.sub(r'\1\2', i) in names) ]
+
+def group_documents(entries):
+	'''Groups documents by catalog root, which defaults to the root of the document name'''
+	groups = collections.OrderedDict()
+	found = set()
+	for input, root in entries:
+		if input in found:
+			continue #first entry wins, e.g. a manifest line over a glob match
+		found.add(input)
+		groups.setdefault(root or os.path.splitext(input)[0], []).append(input)
+	return groups
+
+def group_template(documents):
+	template = documents[0].template()
+	for document in documents[1:]:
+		for i in document.template():
+			if i.key in template:
+				template[i.key].references += [ j for j in i.references if j not in template[i.key].references ]
+			else:
+				template.add(i)
+	return template
+
+def _extract_job(root, inputs, translations):
+	documents = [ translator.Document.load(i) for i in inputs ]
+	template = group_template(documents)
+	changed = update_catalogs(root+'.tex', documents[0], template, root+'.pot', translations)
+	return documents, changed
+
+def shared_documents(extracted):
+	'''Files of document graphs of more than one catalog root, mapped to the list of these roots'''
+	roots = collections.OrderedDict()
+	for root, documents in extracted.items():
+		for name in sorted(set([ os.path.abspath(j.name) for i in documents for j in i.documents() ])):
+			roots.setdefault(name, []).append(root)
+	return collections.OrderedDict([ (name, i) for name, i in roots.items() if len(i) > 1 ])
+
+def _translate_job(documents, translation):
+	translation.parse()
+	result = []
+	for document in documents:
+		translated = translation.translate(document)
+		result.append((document.name, translated.name, build_digest(document, translation, translated)))
+	return result
+
+def _compile_job(translated, output_directory):
+	return translator.Document.load(translated).generate(output_directory)
+
+def batch(entries, languages=None, jobs=1):
+	'''Builds many documents; catalogs shared by documents are loaded once per language'''
+	groups = group_documents(entries)
+	translations = collections.OrderedDict()
+	for root, inputs in groups.items():
+		#catalogs are found as translations of a document named after their root
+		translations[root] = [ translator.Translation(root+'.tex', 'en_US') ]+translator.find_translations(
+			root+'.tex', languages=languages.split(',') if languages else None)
+	results = collections.OrderedDict([ ((i, j.locale), None) for root, inputs in groups.items()
+		for i in inputs for j in translations[root] ])
+	digests = {}
+	updated = []
+	extracted = collections.OrderedDict()
+	today = datetime.date.today()
+	translator.set_today(today)
+
+	#documents are scanned in the workers only, so date formatters are created on first use
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=translator.initialize_worker,
+			initargs=([], today)) as executor:
+		pending = {}
+		for root, inputs in groups.items():
+			keys = [ i for i in results if i[0] in inputs ]
+			pending[executor.submit(_extract_job, root, inputs, translations[root])] = ('extract', root, keys)
+		while pending:
+			done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				stage, name, keys = pending.pop(future)
+				try:
+					result = future.result()
+				except Exception as e:
+					for key in keys:
+						results[key] = 'failed: {}'.format(e)
+					continue
+				if stage == 'extract':
+					documents, changed = result
+					if changed:
+						updated.append(name)
+						for key in keys:
+							results[key] = 'skipped, translations need to be updated'
+						continue
+					extracted[name] = (documents, keys)
+				elif stage == 'translate':
+					for input, translated, digest in result:
+						#own directory per document and language, so outputs of equally named documents do not collide
+						output_directory = os.path.join(os.path.splitext(input)[0]+'.build', name)
+						output = translator.Document.load(translated).output(output_directory)
+						cache = BuildCache(input)
+						up_to_date = cache.digest(name) == digest and os.path.exists(output)
+						cache.close()
+						if up_to_date:
+							results[(input, name)] = 'up to date'
+							continue
+						digests[(input, name)] = digest
+						future = executor.submit(_compile_job, translated, output_directory)
+						pending[future] = ('compile', input, [ (input, name) ])
+				else:
+					input, locale = keys[0]
+					cache = BuildCache(input)
+					cache.record(locale, digests[(input, locale)], result)
+					cache.close()
+					results[(input, locale)] = 'built'
+			if extracted and not [ i for i in pending.values() if i[0] == 'extract' ]:
+				#translated copies of a file are named by locale only, so catalogs of two roots would overwrite each other's
+				shared = {}
+				for file, roots in shared_documents(collections.OrderedDict([ (i, j[0]) for i, j in extracted.items() ])).items():
+					for root in roots:
+						shared.setdefault(root, file)
+				for root, (documents, keys) in extracted.items():
+					if root in shared:
+						for key in keys:
+							results[key] = 'failed: {} is also used by documents with other catalogs'.format(shared[root])
+						continue
+					for i in translations[root]:
+						future = executor.submit(_translate_job, documents, i)
+						pending[future] = ('translate', i.locale, [ j for j in keys if j[1] == i.locale ])
+				extracted.clear()
+	return results, updated
+
+def report_batch(results, updated):
+	for (input, locale), status in results.items():
+		sys.stdout.write('{:<40} {:<8} {}\n'.format(input, locale, status))
+	counts = collections.Counter([ 'failed' if i.startswith('failed') else i for i in results.values() ])
+	sys.stdout.write('{} built, {} up to date, {} failed, {} skipped\n'.format(counts['built'], counts['up to date'],
+		counts['failed'], len(results)-counts['built']-counts['up to date']-counts['failed']))
+	for root in updated:
+		sys.stdout.write('Translations of {} have changed. Please update them and restart the process\n'.format(root))
+	return counts['failed'] == 0 and not updated
+
+class Watcher:
+	POLL_INTERVAL = 0.5
+	SETTLE_TIME = 0.1
+
+	def __init__(self, files):
+		self.files = dict([ (os.path.abspath(i), i) for i in files ])
+		self._inotify = None
+		if inotify_simple:
+			self._inotify = inotify_simple.INotify()
+			flags = inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO | inotify_simple.flags.CREATE
+			self._directories = {}
+			for i in set([ os.path.dirname(i) for i in self.files ]):
+				self._directories[self._inotify.add_watch(i, flags)] = i
+		else:
+			self._mtimes = self._stat()
+
+	def _stat(self):
+		mtimes = {}
+		for i in self.files:
+			try:
+				mtimes[i] = os.stat(i).st_mtime_ns
+			except FileNotFoundError:
+				mtimes[i] = None
+		return mtimes
+
+	def wait(self):
+		changed = set()
+		while not changed:
+			if self._inotify:
+				for event in self._inotify.read(read_delay=int(self.SETTLE_TIME*1000)):
+					name = os.path.join(self._directories[event.wd], event.name)
+					if name in self.files:
+						changed.add(self.files[name])
+			else:
+				time.sleep(self.POLL_INTERVAL)
+				mtimes = self._stat()
+				changed = set([ self.files[i] for i in mtimes if mtimes[i] != self._mtimes[i] ])
+				self._mtimes = mtimes
+		return changed
+
+def watch(input, languages=None, jobs=1):
+	document, translations = load(input, languages)
+	files = dict([ (i.file, i) for i in translations if i.file ])
+	sources = None
+	watcher = None
+	changed = set([ input ])
+	first = True
+	try:
+		while True:
+			try:
+				if sources is None or changed & sources:
+					affected = translations
+					if update(input, document, translations):
+						sys.stderr.write('Some translations has changed. Please update them\n')
+				else:
+					affected = [ files[i] for i in changed ]
+					for i in affected:
+						i.reload()
+				outputs, failures = build_all(input, document, affected, jobs)
+				if first:
+					open_outputs(translations, outputs)
+					first = False
+				report_failures(failures)
+				names = set([ i.name for i in document.documents() ])
+				if names != sources:
+					sources = names
+					watcher = Watcher(list(files)+list(sources))
+			except Exception as e:
+				#e.g. a file saved in the middle of an edit; everything is updated after the next change
+				sys.stderr.write('Update failed: {}\n'.format(e))
+				sources = None
+				watcher = watcher or Watcher(list(files)+[ input ])
+			sys.stderr.write('Watching {} for changes...\n'.format(', '.join(sorted(watcher.files.values()))))
+			changed = watcher.wait()
+	except KeyboardInterrupt:
+		pass
+
+class TestGenerate(unittest.TestCase):
+	def test_read_manifest(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			name = os.path.join(directory, 'manifest')
+			with open(name, 'w') as f:
+				f.write('# documents\na.tex\n\n  b/index.tex   shared # comment\n')
+			self.assertEqual([ ('a.tex', None), ('b/index.tex', 'shared') ], read_manifest(name))
+
+	def test_find_documents(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			os.mkdir(os.path.join(directory, 'b'))
+			for i in ('a.tex', 'a.de_DE.tex', 'b/index.tex', 'b/index.pl_PL.tex', 'b/c.de_DE.tex', 'b/c.po'):
+				open(os.path.join(directory, i), 'w').close()
+			self.assertEqual([ os.path.join(directory, i) for i in ('a.tex', 'b/c.de_DE.tex', 'b/index.tex') ],
+				[ i for i, _ in find_documents([ os.path.join(directory, '**', '*.tex') ]) ])
+
+	def test_group_documents(self):
+		groups = group_documents([ ('a/index.tex', 'shared'), ('b/index.tex', 'shared'), ('c.tex', None),
+			('a/index.tex', None), ('d.tex', None) ])
+		self.assertEqual([ ('shared', ['a/index.tex', 'b/index.tex']), ('c', ['c.tex']), ('d', ['d.tex']) ],
+			list(groups.items()))
+
+	def test_shared_documents(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			for name, content in (('a.tex', '\\input{chap}'), ('b.tex', '\\input{chap}'), ('c.tex', ''), ('chap.tex', '')):
+				with open(os.path.join(directory, name), 'w') as f:
+					f.write(content)
+			cwd = os.getcwd()
+			os.chdir(directory)
+			try:
+				documents = dict([ (i, [ translator.Document(i+'.tex') ]) for i in ('a', 'b', 'c') ])
+				self.assertEqual({ os.path.abspath('chap.tex'): ['a', 'b'] }, shared_documents(documents))
+				self.assertEqual({}, shared_documents({ 'ab': documents['a']+documents['b'], 'c': documents['c'] }))
+			finally:
+				os.chdir(cwd)
+
+	def test_watch_errors(self):
+		import tempfile
+		from unittest import mock
+		with tempfile.TemporaryDirectory() as directory:
+			input = os.path.join(directory, 'doc.tex')
+			with open(input, 'w') as f:
+				f.write('\\gettext{a}')
+			edits = iter([ '\\gettext{a', '\\gettext{b}' ])
+			def edit():
+				content = next(edits, None)
+				if content is None:
+					raise KeyboardInterrupt()
+				with open(input, 'w') as f:
+					f.write(content)
+				return set([ input ])
+			with mock.patch.object(Watcher, 'wait', side_effect=edit), \
+					mock.patch(__name__+'.build_all', return_value=({}, {})) as build_all, \
+					mock.patch('sys.stderr') as stderr:
+				watch(input)
+			self.assertEqual(2, build_all.call_count)
+			self.assertIn(mock.call('Update failed: Could not find end for tag that starts at line 1 (\\gettext --> {a)\n'),
+				stderr.write.mock_calls)
+			with open(os.path.join(directory, 'doc.pot')) as f:
+				self.assertIn('msgid "b"', f.read())
 
-	for i in outputs:
-		subprocess.check_call(['xdg-open', i])
+	def test_update_catalogs(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			input = os.path.join(directory, 'doc.tex')
+			with open(input, 'w') as f:
+				f.write('\\gettext{a} \\gettext{b}')
+			document = translator.Document(input)
+			translation = translator.Translation(input, 'de_DE', os.path.join(directory, 'doc.de_DE.po'))
+			update = lambda: update_catalogs(input, document, document.template(), document.template_name(), [ translation ])
+			self.assertTrue(update())
+			self.assertFalse(update())
+			with open(translation.file) as f:
+				content = f.read()
+			with open(translation.file, 'w') as f:
+				f.write(content[:content.index('#: ')]) #older version, without messages
+			self.assertTrue(update())
+			with open(translation.file) as f:
+				self.assertIn('msgid "b"', f.read())
+			self.assertFalse(update())
+			with open(input, 'w') as f:
+				f.write('\n\\gettext{a} \\gettext{b}')
+			with open(translation.file, 'a') as f:
+				f.write('# edited\n')
+			self.assertFalse(update()) #only references moved
+			with open(translation.file) as f:
+				self.assertIn('doc.tex:2\nmsgid "a"', f.read())
+			with open(input, 'a') as f:
+				f.write(' \\gettext{c}')
+			update_catalogs(input, document, document.template(), document.template_name(), []) #no catalogs yet
+			with open(document.template_name()) as f:
+				self.assertIn('msgid "c"', f.read())
 
 def main():
 	parser = argparse.ArgumentParser(description='Documents internationalization tool (version {})'.format(VERSION))
@@ -43,8 +629,36 @@ def main():
 	parser.add_argument('--languages', action='store',
 		help='List of language codes for which outputs will be generated.'+
 		'Default list is built from names of found translation files', default=None)
+	parser.add_argument('--jobs', action='store', type=int,
+		help='Number of languages built in parallel, each in its own output directory (default: 1)', default=1)
+	parser.add_argument('--watch', action='store_true',
+		help='Keep running and rebuild languages affected by changes of input or translation files')
+	parser.add_argument('--manifest', action='store', metavar='PATH', default=None,
+		help='Build all documents listed in given file, one per line, optionally followed by root name '+
+		'of catalogs shared with other documents')
+	parser.add_argument('--glob', action='append', metavar='PATTERN', default=None,
+		help='Build all documents matching given pattern (may be repeated)')
+	parser.add_argument('--extract-only', action='store_true',
+		help='Only extract phrases into the template (.pot) file; translations are neither updated nor built')
+	parser.add_argument('--profile', action='store_true',
+		help='Print wall and CPU time of every build stage and language')
+	parser.add_argument('--timings-json', action='store', metavar='PATH',
+		help='Write wall and CPU time of every build stage and language, as JSON, to given file', default=None)
+	parser.add_argument('--profile-dump', action='store', metavar='PATH',
+		help='Write cProfile statistics of Python build stages to given file '+
+		'(stages run in worker processes with --jobs are not included)', default=None)
 	args = parser.parse_args()
-	generate(input=args.input, languages=args.languages)
+	if args.manifest or args.glob:
+		entries = (read_manifest(args.manifest) if args.manifest else [])+find_documents(args.glob or [])
+		if not report_batch(*batch(entries, languages=args.languages, jobs=args.jobs)):
+			sys.exit(1)
+	elif args.extract_only:
+		extract(input=args.input, profile=args.profile, timings_json=args.timings_json, profile_dump=args.profile_dump)
+	elif args.watch:
+		watch(input=args.input, languages=args.languages, jobs=args.jobs)
+	else:
+		generate(input=args.input, languages=args.languages, jobs=args.jobs,
+			profile=args.profile, timings_json=args.timings_json, profile_dump=args.profile_dump)
 
 if __name__ == '__main__':
 	main()
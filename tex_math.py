@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import operator
+import os
 import re
+import shutil
 import subprocess
-import sys
+import tempfile
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 COMMAND_PREFIX = 'gettextmath'
+VERIFY_PREFIX = 'GETTEXTMATHVERIFY'
+VERIFY_COMMAND = 'gettextmathverify'
 
 def generate_command_call(name, prefix, *args):
     return '\\' + prefix + name + '{' + '}{'.join(args) + '}'
@@ -30,6 +40,12 @@ class Parser:
         def generate(self):
             return str(self.number)
 
+        def evaluate(self, values):
+            return self.number
+
+        def evaluate_array(self, values):
+            return self.number
+
         def __eq__(self, other):
             return isinstance(other, Parser.Number) and self.number == other.number
 
@@ -43,6 +59,14 @@ class Parser:
         def generate(self):
             return self.identifier
 
+        def evaluate(self, values):
+            if self.identifier not in values:
+                raise Exception('Identifier "{}" has no value'.format(self.identifier))
+            return values[self.identifier]
+
+        def evaluate_array(self, values):
+            return self.evaluate(values)
+
         def __eq__(self, other):
             return isinstance(other, Parser.Identifier) and self.identifier == other.identifier
 
@@ -75,41 +99,66 @@ class Parser:
         def generate(self):
             return generate_command_call(self.command, COMMAND_PREFIX, self.arg1.generate(), self.arg2.generate())
 
+        def evaluate(self, values):
+            return int(self.operator(self.arg1.evaluate(values), self.arg2.evaluate(values)))
+
+        def evaluate_array(self, values):
+            result = getattr(numpy, self.ufunc)(self.arg1.evaluate_array(values), self.arg2.evaluate_array(values))
+            return numpy.asarray(result, dtype=numpy.int64)
+
     class OperatorEqual(BinaryOperator):
         priority = 7
         command = 'equal'
+        operator = staticmethod(operator.eq)
+        ufunc = 'equal'
 
     class OperatorNotEqual(BinaryOperator):
         priority = 7
         command = 'notequal'
+        operator = staticmethod(operator.ne)
+        ufunc = 'not_equal'
 
     class OperatorGreaterEqual(BinaryOperator):
         priority = 6
         command = 'greaterequal'
+        operator = staticmethod(operator.ge)
+        ufunc = 'greater_equal'
 
     class OperatorLesserEqual(BinaryOperator):
         priority = 6
         command = 'lesserequal'
+        operator = staticmethod(operator.le)
+        ufunc = 'less_equal'
 
     class OperatorGreaterThan(BinaryOperator):
         priority = 6
         command = 'greaterthan'
+        operator = staticmethod(operator.gt)
+        ufunc = 'greater'
 
     class OperatorLesserThan(BinaryOperator):
         priority = 6
         command = 'lesserthan'
+        operator = staticmethod(operator.lt)
+        ufunc = 'less'
 
     class OperatorAnd(BinaryOperator):
         priority = 11
         command = 'and'
+        operator = staticmethod(lambda a, b: bool(a) and bool(b))
+        ufunc = 'logical_and'
 
     class OperatorOr(BinaryOperator):
         priority = 12
         command = 'or'
+        operator = staticmethod(lambda a, b: bool(a) or bool(b))
+        ufunc = 'logical_or'
 
     class OperatorModulo(BinaryOperator):
         priority = 3
         command = 'modulo'
+        operator = staticmethod(operator.mod)
+        ufunc = 'mod'
 
     class OperatorTernaryStart(Operator):
         priority = 100
@@ -124,6 +173,16 @@ class Parser:
         def generate(self):
             return generate_command_call('ifthenelse', COMMAND_PREFIX, self.arg_condition.generate(), self.arg_truefalse.true.generate(), self.arg_truefalse.false.generate())
 
+        def evaluate(self, values):
+            if self.arg_condition.evaluate(values):
+                return self.arg_truefalse.true.evaluate(values)
+            return self.arg_truefalse.false.evaluate(values)
+
+        def evaluate_array(self, values):
+            return numpy.where(self.arg_condition.evaluate_array(values) != 0,
+                self.arg_truefalse.true.evaluate_array(values),
+                self.arg_truefalse.false.evaluate_array(values))
+
     class OperatorTernaryMiddle(Operator):
         priority = 100
         function = False
@@ -157,26 +216,28 @@ class Parser:
 
     tokens = [
         # boolean operations
-        (re.compile(r'^(==)'), OperatorEqual),
-        (re.compile(r'^(!=)'), OperatorNotEqual),
-        (re.compile(r'^(>=)'), OperatorGreaterEqual),
-        (re.compile(r'^(<=)'), OperatorLesserEqual),
-        (re.compile(r'^(>)'), OperatorGreaterThan),
-        (re.compile(r'^(<)'), OperatorLesserThan),
-        (re.compile(r'^(&&)'), OperatorAnd),
-        (re.compile(r'^(\|\|)'), OperatorOr),
-        (re.compile(r'^(\?)'), OperatorTernaryStart),
-        (re.compile(r'^(:)'), OperatorTernaryMiddle),
+        ('equal', r'==', OperatorEqual),
+        ('notequal', r'!=', OperatorNotEqual),
+        ('greaterequal', r'>=', OperatorGreaterEqual),
+        ('lesserequal', r'<=', OperatorLesserEqual),
+        ('greaterthan', r'>', OperatorGreaterThan),
+        ('lesserthan', r'<', OperatorLesserThan),
+        ('and', r'&&', OperatorAnd),
+        ('or', r'\|\|', OperatorOr),
+        ('ternarystart', r'\?', OperatorTernaryStart),
+        ('ternarymiddle', r':', OperatorTernaryMiddle),
         # arithmentic operations
-        (re.compile(r'^(%)'), OperatorModulo),
+        ('modulo', r'%', OperatorModulo),
         # parenthesis
-        (re.compile(r'^\('), OpenParenthesis),
-        (re.compile(r'^\)'), CloseParenthesis),
+        ('openparenthesis', r'\(', OpenParenthesis),
+        ('closeparenthesis', r'\)', CloseParenthesis),
         # others
-        (re.compile(r'^([0-9]+)'), Number),
-        (re.compile(r'^([_A-Za-z][_A-Za-z0-9]*)'), Identifier),
-        (re.compile(r'^\s+'), None),
+        ('number', r'[0-9]+', Number),
+        ('identifier', r'[_A-Za-z][_A-Za-z0-9]*', Identifier),
+        ('whitespace', r'\s+', None),
     ]
+    pattern = re.compile('|'.join(['(?P<{}>{})'.format(i[0], i[1]) for i in tokens]))
+    token_types = dict([ (i[0], i[2]) for i in tokens ])
 
     def __init__(self, source):
         self.source = source
@@ -189,21 +250,20 @@ class Parser:
         source = self.source
         output = []
         stack = []
-        while len(source) > 0:
-            for i in self.tokens:
-                m = i[0].match(source)
-                if m:
-                    break
+        pos = 0
+        while pos < len(source):
+            m = self.pattern.match(source, pos)
             if not m:
-                raise Exception('No token matches "{}<...>"'.format(source[:10]))
-
-            source = source[len(m.group(0)):]
-            token = i[1]
+                raise Exception('No token matches "{}<...>" at column {}'.format(source[pos:pos+10], pos+1))
+            pos = m.end()
+            token = self.token_types[m.lastgroup]
             if not token:
                 continue
-            args = m.groups()
-            token = token(*args)
-            token = token.process(stack, output)
+            if token in (Parser.OpenParenthesis, Parser.CloseParenthesis):
+                token = token()
+            else:
+                token = token(m.group())
+            token.process(stack, output)
         while len(stack) > 0:
             output.append(stack.pop())
         o = []
@@ -219,15 +279,33 @@ class Generator:
     def __init__(self, queue):
         self.queue = queue
 
-    def generate(self):
+    def _consume(self):
         stack = []
         for i in self.queue:
             i.consume(stack)
         if len(stack) != 1:
             raise Exception('RPN processing problem, stack size is not 1 ({})'.format(repr(stack)))
-        r = stack[0]
-        r = r.generate()
-        return r
+        return stack[0]
+
+    def generate(self):
+        return self._consume().generate()
+
+    def evaluate(self, values=None):
+        return self._consume().evaluate(values or {})
+
+    def evaluate_batch(self, identifier, values, bound=None):
+        '''Evaluates expression for every element of values, vectorized with NumPy if it is available'''
+        root = self._consume()
+        bound = dict(bound or {})
+        if numpy is None:
+            result = []
+            for i in values:
+                bound[identifier] = i
+                result.append(root.evaluate(bound))
+            return result
+        values = numpy.asarray(values, dtype=numpy.int64)
+        bound[identifier] = values
+        return numpy.broadcast_to(root.evaluate_array(bound), values.shape)
 
 def generate_command(name, source, new_command=True):
     s = '\\newcommand' if new_command else '\\renewcommand'
@@ -238,7 +316,89 @@ def generate_command(name, source, new_command=True):
     s += '}'
     return s
 
+def _verify_command(index):
+    name = ''
+    index += 1
+    while index > 0:
+        index, rest = divmod(index-1, 26)
+        name = chr(ord('a')+rest) + name
+    return '\\' + VERIFY_COMMAND + name
+
+def generate_verification(rules, values, options=None):
+    '''Generates document which writes value of every rule for every n into the log'''
+    lines = ['\\documentclass{article}']
+    lines.append('\\usepackage'+('['+options+']' if options else '')+'{gettext}')
+    for index, rule in enumerate(rules):
+        lines.append(generate_command(_verify_command(index), rule))
+    lines.append('\\begin{document}')
+    for index, rule in enumerate(rules):
+        for n in values:
+            lines.append('\\typeout{{{} {} {} {}{{{}}}}}'.format(VERIFY_PREFIX, index, n, _verify_command(index), n))
+    lines.append('\\end{document}')
+    return '\n'.join(lines)+'\n'
+
+def verify(rules, values, latex='latex', options=None):
+    '''Evaluates all rules for all values with a single TeX run, returns list of results for every rule'''
+    package = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'verify.tex')
+        with open(name, 'w') as f:
+            f.write(generate_verification(rules, values, options))
+        env = dict(os.environ)
+        env['TEXINPUTS'] = package + os.pathsep + env.get('TEXINPUTS', '')
+        subprocess.check_call([latex, '-interaction=nonstopmode', '-halt-on-error', name],
+            cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        results = [ {} for i in rules ]
+        with open(os.path.join(directory, 'verify.log'), errors='replace') as f:
+            for line in f:
+                if not line.startswith(VERIFY_PREFIX+' '):
+                    continue
+                _, index, n, value = line.split(' ', 3)
+                results[int(index)][int(n)] = int(value.replace(' ', ''))
+    return [ [ i.get(n, None) for n in values ] for i in results ]
+
 class TestMath(unittest.TestCase):
+    functions = [(
+        '0',
+        lambda n: 0
+    ),(
+        'n != 1',
+        lambda n: int(n != 1)
+    ),(
+        'n>1',
+        lambda n: int(n > 1)
+    ),(
+        'n>1 ? 1 : 0',
+        lambda n: 1 if n > 1 else 0
+    ),(
+        'n==0 ? 10 : n==1 ? 11 : 12',
+        lambda n: 10 if n == 0 else (11 if n == 1 else 12)
+    ),(
+        'n%10==1 && n%100!=11 ? 0 : n != 0 ? 1 : 2',
+        lambda n: 0 if n%10 == 1 and n%100 != 11 else (1 if n != 0 else 2)
+    ),(
+        'n==1 ? 0 : n==2 ? 1 : 2',
+        lambda n: 0 if n == 1 else (1 if n == 2 else 2)
+    ),(
+        'n==1 ? 0 : (n==0 || (n%100 > 0 && n%100 < 20)) ? 1 : 2',
+        lambda n: 0 if n == 1 else (1 if (n == 0 or (n%100 > 0 and n%100 < 20)) else 2)
+    ),(
+        'n%10==1 && n%100!=11 ? 0 :  n%10>=2 && (n%100<10 || n%100>=20) ? 1 : 2',
+        lambda n: 0 if n%10 == 1 and n%100 != 11 else (1 if n%10>=2 and (n%100<10 or n%100>=20) else 2)
+    ),(
+        'n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2',
+        lambda n: 0 if n%10 == 1 and n%100 != 11 else (1 if n%10>=2 and n%10<=4 and (n%100<10 or n%100>=20) else 2)
+    ),(
+        '(n==1) ? 0 : (n>=2 && n<=4) ? 1 : 2',
+        lambda n: 0 if n == 1 else (1 if n >= 2 and n <= 4 else 2)
+    ),(
+        'n==1 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2',
+        lambda n: 0 if n == 1 else (1 if n%10 >= 2 and n%10 <= 4 and (n%100 < 10 or n%100 >= 20) else 2)
+    ),(
+        'n%100==1 ? 0 : n%100==2 ? 1 : n%100==3 || n%100==4 ? 2 : 3',
+        lambda n: 0 if n%100 == 1 else (1 if n%100 == 2 else (2 if n%100 == 3 or n%100 == 4 else 3))
+    )]
+
     def test_parser(self):
         exprs = [(
             '0',
@@ -367,88 +527,47 @@ class TestMath(unittest.TestCase):
             parser = Parser(i[0])
             self.assertEqual(i[1], parser.parse(), 'expression parsed incorrectly: "{}"'.format(i[0]))
 
+        with self.assertRaisesRegex(Exception, 'at column 6'):
+            Parser('n == $1').parse()
+
+    def test_evaluate(self):
+        for i in self.functions:
+            parser = Parser(i[0])
+            generator = Generator(parser.parse())
+            for n in range(0, 1000):
+                self.assertEqual(i[1](n), generator.evaluate({'n': n}), 'expression evaluated incorrectly: "{}" for n={}'.format(i[0], n))
+        with self.assertRaises(Exception):
+            Generator(Parser('n == 1').parse()).evaluate()
+
+    def test_evaluate_batch(self):
+        values = range(0, 1000001 if numpy is not None else 10001)
+        for i in self.functions:
+            generator = Generator(Parser(i[0]).parse())
+            expected = list(map(i[1], values))
+            actual = [ int(n) for n in generator.evaluate_batch('n', values) ]
+            self.assertEqual(expected, actual, 'expression evaluated incorrectly: "{}"'.format(i[0]))
+
+    def test_verification_document(self):
+        document = generate_verification(['n != 1', 'n%10'], [0, 7])
+        self.assertIn(generate_command(_verify_command(1), 'n%10'), document)
+        self.assertIn('\\typeout{'+VERIFY_PREFIX+' 1 7 '+_verify_command(1)+'{7}}', document)
+        self.assertEqual(['\\gettextmathverifya', '\\gettextmathverifyz', '\\gettextmathverifyaa'],
+            [ _verify_command(i) for i in (0, 25, 26) ])
+
+    def _test_calculations(self, options=None):
+        values = list(range(0,30))+list(range(40,300,10))+list(range(400,3000,100))
+        results = verify([ i[0] for i in self.functions ], values, options=options)
+        for i, actual in zip(self.functions, results):
+            expected = [ i[1](n) for n in values ]
+            self.assertEqual(expected, actual, 'expression calculated incorrectly by TeX: "{}"'.format(i[0]))
+
+    @unittest.skipUnless(shutil.which('latex'), 'latex is required')
     def test_calculations(self):
-        functions = [(
-            '0',
-            lambda n: 0
-        ),(
-            'n != 1',
-            lambda n: int(n != 1)
-        ),(
-            'n>1',
-            lambda n: int(n > 1)
-        ),(
-            'n>1 ? 1 : 0',
-            lambda n: 1 if n > 1 else 0
-        ),(
-            'n==0 ? 10 : n==1 ? 11 : 12',
-            lambda n: 10 if n == 0 else (11 if n == 1 else 12)
-        ),(
-            'n%10==1 && n%100!=11 ? 0 : n != 0 ? 1 : 2',
-            lambda n: 0 if n%10 == 1 and n%100 != 11 else (1 if n != 0 else 2)
-        ),(
-            'n==1 ? 0 : n==2 ? 1 : 2',
-            lambda n: 0 if n == 1 else (1 if n == 2 else 2)
-        ),(
-            'n==1 ? 0 : (n==0 || (n%100 > 0 && n%100 < 20)) ? 1 : 2',
-            lambda n: 0 if n == 1 else (1 if (n == 0 or (n%100 > 0 and n%100 < 20)) else 2)
-        ),(
-            'n%10==1 && n%100!=11 ? 0 :  n%10>=2 && (n%100<10 || n%100>=20) ? 1 : 2',
-            lambda n: 0 if n%10 == 1 and n%100 != 11 else (1 if n%10>=2 and (n%100<10 or n%100>=20) else 2)
-        ),(
-            'n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2',
-            lambda n: 0 if n%10 == 1 and n%100 != 11 else (1 if n%10>=2 and n%10<=4 and (n%100<10 or n%100>=20) else 2)
-        ),(
-            '(n==1) ? 0 : (n>=2 && n<=4) ? 1 : 2',
-            lambda n: 0 if n == 1 else (1 if n >= 2 and n <= 4 else 2)
-        ),(
-            'n==1 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2',
-            lambda n: 0 if n == 1 else (1 if n%10 >= 2 and n%10 <= 4 and (n%100 < 10 or n%100 >= 20) else 2)
-        ),(
-            'n%100==1 ? 0 : n%100==2 ? 1 : n%100==3 || n%100==4 ? 2 : 3',
-            lambda n: 0 if n%100 == 1 else (1 if n%100 == 2 else (2 if n%100 == 3 or n%100 == 4 else 3))
-        )]
+        self._test_calculations()
 
-        re_text = re.compile(r'<text(.*?)>(.*?)</text>', re.DOTALL)
-        re_tspan = re.compile(r'</?tspan(.*?)>', re.DOTALL)
-
-        TEST_FILE_PREFIX = '_test'
-
-        for i in functions:
-            sys.stderr.write('*')
-            sys.stderr.flush()
-            for n in list(range(0,30))+list(range(40,300,10))+list(range(400,3000,100)):
-                sys.stderr.write('.')
-                sys.stderr.flush()
-                with open(TEST_FILE_PREFIX+'.tex', 'w') as f:
-                    f.write('\documentclass{article}\n')
-                    f.write('\\usepackage{tipa}\n')
-                    f.write('\\usepackage{gettext}\n')
-                    f.write(generate_command('\\testfn', i[0]))
-                    f.write('\n')
-                    f.write('\\begin{document}\n')
-                    f.write('\\testfn{''')
-                    f.write(str(n))
-                    f.write('}\n')
-                    f.write('\\end{document}')
-                kwargs = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                subprocess.check_call(['latex', TEST_FILE_PREFIX+'.tex'], **kwargs)
-                subprocess.check_call(['dvisvgm', TEST_FILE_PREFIX+'.dvi'], **kwargs)
-                with open(TEST_FILE_PREFIX+'.svg') as f:
-                    f = f.read()
-                    f = f.replace('\n', '')
-                    f = re_text.findall(f)
-                    f = [ re_tspan.sub(' ', i[1]) for i in f ]
-                    f = ''.join(f)
-                    f = f.strip()
-                    if f.endswith('1'): #strip page number
-                        f = f[:-1]
-                    f = f.strip()
-                    f = int(f)
-
-                expected = i[1](n)
-                actual = f
-                self.assertEqual(expected, actual)
+    @unittest.skipUnless(shutil.which('latex'), 'latex is required')
+    def test_calculations_numexpr(self):
+        self._test_calculations('numexpr')
 
 if __name__ == '__main__':
     import unittest
@@ -1,21 +1,61 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import datetime
-import icu
+import array
+import bisect
+import catalog
+import collections
+import contextlib
+import filecmp
+import functools
+import hashlib
+import importlib.util
+import io
 import locale
+import mmap
 import os
 import re
 import shutil
 import subprocess
 import sys
-import tex_math
-import tzlocal
+import tempfile
+import threading
 import unittest
 
 RE_PO_FILE = re.compile(r'.*\.(.*)\.po$')
 DEFAULT_PLURAL = 'nplurals=2; plural=n != 1'
 
+TAGS = {
+	'\\gettext': 1,
+	'\\pgettext': 2,
+	'\\ngettext': 3,
+	'\\npgettext': 4,
+	'\\today': 0,
+	'\\formatdate': 3,
+	'\\input': 1,
+	'\\include': 1,
+	'\\subfile': 1,
+}
+TRANSLATION_TAGS = ('\\gettext', '\\pgettext', '\\ngettext', '\\npgettext')
+PLURAL_TAGS = ('\\ngettext', '\\npgettext')
+DATE_TAGS = ('\\today', '\\formatdate')
+INCLUDE_TAGS = ('\\input', '\\include', '\\subfile')
+RE_TAG = re.compile(rb'\\(?:'+b'|'.join(sorted([ re.escape(i[1:].encode('ascii')) for i in TAGS ], key=len, reverse=True))+rb')(?![A-Za-z@])')
+RE_BRACE = re.compile(rb'(?<!\\)[{}]')
+RE_ARGUMENT = re.compile(rb'\s*{')
+#\begin{document} not preceded on its line by an unescaped % (a comment)
+RE_BEGIN_DOCUMENT = re.compile(rb'^((?:[^%\\\n]|\\.)*)\\begin\{document\}', re.MULTILINE)
+ENCODING = 'utf-8'
+
+TEMPLATE_HEADER = (
+	'Last-Translator: FULL NAME <EMAIL@ADDRESS>\n'
+	'Language: \n'
+	'MIME-Version: 1.0\n'
+	'Content-Type: text/plain; charset=UTF-8\n'
+	'Content-Transfer-Encoding: 8bit\n'
+	'Plural-Forms: nplurals=INTEGER; plural=EXPRESSION;\n'
+)
+
 class Tag:
 	class Argument:
 		def __init__(self, content, begin_pos, end_pos):
@@ -42,79 +82,297 @@ class Tag:
 		return isinstance(other, Tag) and self.name == other.name and self.args == other.args
 
 	def __hash__(self):
-		return hash(self.name)+sum([hash(i) for i in self.args])
+		return hash((self.name,)+tuple(self.args))
 
 	def __str__(self):
 		return self.name+''.join(['{'+str(i)+'}' for i in self.args])
 
+	def key(self):
+		'''Catalog key of the message, (msgid, msgctxt)'''
+		if self.name in ('\\gettext', '\\ngettext'):
+			return (self.args[0].content, None)
+		elif self.name in ('\\pgettext', '\\npgettext'):
+			return (self.args[1].content, self.args[0].content)
+		return None
+
+	def message(self):
+		args = [ i.content for i in self.args ]
+		if self.name == '\\gettext':
+			return catalog.Message(args[0])
+		elif self.name == '\\pgettext':
+			return catalog.Message(args[1], msgctxt=args[0])
+		elif self.name == '\\ngettext':
+			return catalog.Message(args[0], msgid_plural=args[1])
+		elif self.name == '\\npgettext':
+			return catalog.Message(args[1], msgctxt=args[0], msgid_plural=args[2])
+		return None
+
+class LineIndex:
+	def __init__(self, text):
+		newline = '\n' if isinstance(text, str) else b'\n'
+		self.offsets = array.array('q')
+		pos = text.find(newline)
+		while pos >= 0:
+			self.offsets.append(pos)
+			pos = text.find(newline, pos+1)
+
+	def __len__(self):
+		return len(self.offsets)+1
+
+	def line(self, pos):
+		return bisect.bisect_left(self.offsets, pos)+1
+
+	def column(self, pos):
+		line = self.line(pos)
+		return pos+1 if line == 1 else pos-self.offsets[line-2]
+
 class Document:
+	TAG_CACHE_SIZE = 4096
+	_tag_cache = collections.OrderedDict()
+	_tag_cache_lock = threading.Lock()
+
 	@staticmethod
 	def load(file):
 		return Document(file)
 
-	def __init__(self, name):
+	def __init__(self, name, graph=None):
 		self.name = name
+		self._graph = graph if graph is not None else { os.path.abspath(name): self }
+		self._stat = None
+		self._digest = None
+		self._tags = None
+		self._messages = None
+		self._includes = None
+		self._line_index = None
 
 	def __str__(self):
 		return self.name
 
-	def generate(self):
-		root, _ = os.path.splitext(self.name)
-		output = root+'.pdf'
-		subprocess.check_call(['xelatex', self.name])
-		return output
-
-	def find_tags(self, tag, nargs=1):
-		with open(self.name) as file:
-			doc = file.read()
-			line_number = [ 0 for i in range(len(doc)) ]
-			line = 1
-			for i in range(len(doc)):
-				line_number[i] = line
-				if doc[i] == '\n':
-					line += 1
-
-			texts = list()
-			pos = 0
-
-			def _find_matching_closing(i):
-				depth = 0
-				while True:
-					pc = doc[i-1] if i-1 > 0 else None
-					c = doc[i]
-					if c == '{' and pc != '\\':
-						depth += 1
-					elif c == '}' and pc != '\\':
-						depth -= 1
-					if depth == 0:
-						break
-					i += 1
+	def _file_stat(self):
+		stat = os.stat(self.name)
+		return (stat.st_mtime_ns, stat.st_size)
+
+	def _ensure_scanned(self):
+		stat = self._file_stat()
+		if stat == self._stat:
+			return
+		with self.buffer() as source:
+			self._stat = stat
+			digest = hashlib.sha1(source).hexdigest()
+			if digest == self._digest:
+				return
+			tags = Document._cached_tags(digest)
+			if tags is None:
+				sys.stderr.write('Scanning {}...\n'.format(self.name))
+				tags = Document.scan(source)
+				Document._cache_tags(digest, tags)
+		self._tags = tags
+		self._digest = digest
+		self._messages = None
+		self._includes = None
+		self._line_index = None
+
+	@staticmethod
+	def _cached_tags(digest):
+		with Document._tag_cache_lock:
+			tags = Document._tag_cache.get(digest)
+			if tags is not None:
+				Document._tag_cache.move_to_end(digest)
+			return tags
+
+	@staticmethod
+	def _cache_tags(digest, tags):
+		with Document._tag_cache_lock:
+			Document._tag_cache[digest] = tags
+			while len(Document._tag_cache) > Document.TAG_CACHE_SIZE:
+				Document._tag_cache.popitem(last=False)
+
+	@contextlib.contextmanager
+	def buffer(self):
+		'''Read-only, memory-mapped content of the document'''
+		with open(self.name, 'rb') as file:
+			if os.fstat(file.fileno()).st_size == 0:
+				yield b''
+				return
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+				yield source
+
+	def digest(self):
+		self._ensure_scanned()
+		return self._digest
+
+	def tags(self):
+		self._ensure_scanned()
+		return self._tags
+
+	def _own_messages(self):
+		self._ensure_scanned()
+		if self._messages is None:
+			self._messages = list(dict.fromkeys(
+				[ i for i in self._tags if i.name in TRANSLATION_TAGS ]))
+		return self._messages
+
+	def messages(self):
+		'''Messages of all documents of the graph, in order of their first appearance'''
+		return list(dict.fromkeys(
+			[ i for document in self.documents() for i in document._own_messages() ]))
+
+	def resolve(self, tag):
+		'''Name of the file included by tag, or None if it does not exist'''
+		name = tag.args[0].content.strip()
+		if tag.name == '\\subfile':
+			name = os.path.join(os.path.dirname(self.name), name)
+		for i in (name+'.tex', name):
+			if os.path.isfile(i):
 				return i
+		return None
+
+	def includes(self):
+		'''Pairs of (tag, document) for all existing files included by this document'''
+		self._ensure_scanned()
+		if self._includes is None:
+			includes = []
+			for i in self._tags:
+				if i.name not in INCLUDE_TAGS:
+					continue
+				name = self.resolve(i)
+				if name is None:
+					sys.stderr.write('Could not find file included with {}, skipping\n'.format(i))
+					continue
+				key = os.path.abspath(name)
+				if key not in self._graph:
+					self._graph[key] = Document(name, self._graph)
+				includes.append((i, self._graph[key]))
+			self._includes = includes
+		return self._includes
+
+	def documents(self):
+		'''This document and all documents it includes, recursively, in order of first inclusion'''
+		ordered = []
+		visited = set()
+		stack = [ self ]
+		while stack:
+			document = stack.pop()
+			if document in visited:
+				continue
+			visited.add(document)
+			ordered.append(document)
+			stack.extend(reversed([ i for _, i in document.includes() ]))
+		return ordered
+
+	def occurrences(self):
+		'''Ordered mapping of message keys to lists of (document, tag) pairs where they occur'''
+		index = {}
+		for document in self.documents():
+			for i in document.tags():
+				if i.name in TRANSLATION_TAGS:
+					index.setdefault(i.key(), []).append((document, i))
+		return index
+
+	def template(self):
+		template = catalog.Catalog()
+		template.add(catalog.Message('', TEMPLATE_HEADER))
+		for occurrences in self.occurrences().values():
+			message = occurrences[0][1].message()
+			message.references = list(dict.fromkeys([ '{}:{}'.format(document.name, document.line(i.begin_pos))
+				for document, i in occurrences ]))
+			template.add(message)
+		return template
+
+	def template_name(self):
+		root, _ = os.path.splitext(self.name)
+		return root+'.pot'
+
+	def line_index(self):
+		self._ensure_scanned()
+		if self._line_index is None:
+			with self.buffer() as source:
+				self._line_index = LineIndex(source)
+		return self._line_index
+
+	def line(self, pos):
+		return self.line_index().line(pos)
 
-			while True:
-				i = doc.find(tag, pos)
-				if i < 0:
-					break
-				args = []
-				start_tag = i
-				end = start = pos = start_tag+len(tag)
-				for n in range(nargs):
-					try:
-						end = _find_matching_closing(start)
-					except Exception as e:
-						raise Exception(
-							'Could not find end for tag that starts at line '+
-							'{line} ({text})'.format(
-								line=line_number[start], 
-								text=(
-									doc[max(start-20, 0):start]+' --> '+
-									doc[start:min(start+20, len(doc))])
-							))
-					start += 1 #skip initial '{'
-					args.append(Tag.Argument(doc[start:end], start, end))
-					start = doc.find('{', end)
-				texts.append(Tag(tag, args, start_tag, end))
-			return texts
+	def output(self, output_directory=None):
+		root, _ = os.path.splitext(self.name)
+		if output_directory:
+			root = os.path.join(output_directory, os.path.basename(root))
+		return root+'.pdf'
+
+	def generate(self, output_directory=None):
+		command = ['xelatex']
+		kwargs = {}
+		if output_directory:
+			command += ['-interaction=nonstopmode']
+			kwargs['stdout'] = subprocess.DEVNULL
+		#outputs go where output() expects them, not to the working directory
+		directory = output_directory or os.path.dirname(self.name) or '.'
+		#TeX writes the .aux file of \include{sub/file} into sub/ of the output directory, but does not create it
+		for i in set([ directory ]+[ os.path.join(directory, os.path.dirname(tag.args[0].content.strip()))
+				for document in self.documents() for tag, _ in document.includes() if tag.name == '\\include' ]):
+			os.makedirs(i, exist_ok=True)
+		command += ['-output-directory='+directory]
+		subprocess.check_call(command+[self.name], **kwargs)
+		return self.output(output_directory)
+
+	def find_tags(self, tag):
+		return [ i for i in self.tags() if i.name == tag ]
+
+	@staticmethod
+	def scan(doc, line_index=None):
+		'''Finds all tags in the document; positions are byte offsets into its UTF-8 encoding'''
+		if isinstance(doc, str):
+			doc = doc.encode(ENCODING)
+
+		def _find_matching_closing(i):
+			depth = 0
+			for m in RE_BRACE.finditer(doc, i):
+				if m.group(0) == b'{':
+					depth += 1
+				else:
+					depth -= 1
+				if depth == 0:
+					return m.start()
+			raise Exception('Unbalanced braces')
+
+		def _error(start):
+			index = line_index or LineIndex(doc)
+			return Exception(
+				'Could not find end for tag that starts at line '+
+				'{line} ({text})'.format(
+					line=index.line(start),
+					text=(
+						doc[max(start-20, 0):start].decode(ENCODING, 'replace')+' --> '+
+						doc[start:min(start+20, len(doc))].decode(ENCODING, 'replace'))
+				))
+
+		texts = list()
+		pos = 0
+		while True:
+			m = RE_TAG.search(doc, pos)
+			if not m:
+				break
+			tag = m.group(0).decode('ascii')
+			if tag in INCLUDE_TAGS and not RE_ARGUMENT.match(doc, m.end()):
+				pos = m.end() #plain TeX syntax, e.g. \input file
+				continue
+			args = []
+			start_tag = m.start()
+			end = m.end()-1
+			start = m.end()
+			for n in range(TAGS[tag]):
+				start = doc.find(b'{', start)
+				if start < 0 or doc[end+1:start].strip():
+					raise _error(end+1)
+				try:
+					end = _find_matching_closing(start)
+				except Exception as e:
+					raise _error(start)
+				args.append(Tag.Argument(doc[start+1:end].decode(ENCODING), start+1, end))
+				start = end+1
+			texts.append(Tag(tag, args, start_tag, end))
+			pos = end+1
+		return texts
 
 class Translation:
 	ALLOW_NOT_EXISTING = 1
@@ -133,205 +391,222 @@ class Translation:
 				raise Exception('File "{}" does not exists'.format(file))
 		return Translation(input_file, name.group(1), file)
 
-	def __init__(self, input, locale, file=None):
+	@staticmethod
+	def from_catalog(parsed, locale=None):
+		'''Translation backed by an already loaded catalog.Catalog (or CompiledCatalog), not by a file'''
+		locale = locale or parsed.header().get('Language', None)
+		if not locale:
+			raise Exception('Catalog does not specify its language')
+		return Translation(None, locale, parsed=parsed)
+
+	def __init__(self, input, locale, file=None, parsed=None):
 		self.input = input
 		self.locale = locale
 		self.file = file
+		self._catalog = parsed
 		self._parsed = None
-		self._icu_locale = icu.Locale.createFromName(self.locale)
-		self._icu_date_full = icu.DateFormat.createDateInstance(icu.DateFormat.FULL, self._icu_locale)
+		self._plural_forms = None
 
 	def __repr__(self):
 		return 'Translation(input={input}, locale={locale}, file={file})'.format(
 			input=self.input, locale=self.locale, file=self.file
 		)
 
-	def update(self, document):
+	def update(self, document, template=None):
 		if not self.file:
 			return False #nothing to update
-		template_name = self.generate_template(document)
+		if template is None:
+			self.generate_template(document)
+			template = document.template()
 		sys.stderr.write('Updating translation {}...\n'.format(self))
 		if not os.path.exists(self.file):
 			sys.stderr.write('Generating new translation file: {}...\n'.format(self.file))
-			subprocess.check_call(['msginit', '-i', template_name,
-					'-l', self.locale, '-o', self.file])
+			self._set_parsed(catalog.Catalog.init(template, self.locale))
+			self._parsed.write(self.file)
 			return True
-		with open(self.file, 'rb') as f:
-			old = f.read()
+		parsed = catalog.Catalog.read(self.file)
+		merged = parsed.merge(template)
+		if merged == parsed:
+			self._set_parsed(parsed)
+			return False
 		sys.stderr.write('Merging template into translation file: {}...\n'.format(self.file))
-		new = subprocess.check_output(['msgmerge', self.file, template_name])
-		with open(self.file, 'wb') as f:
-			f.write(new)
-		return old != new
+		merged.write(self.file)
+		self._set_parsed(merged)
+		#moved references alone do not need the attention of translators
+		return merged.fingerprint() != parsed.fingerprint()
 
 	def translate(self, document):
+		documents = document.documents()
+		plurals = Translation._needs_plural_definition([ i for j in documents for i in j.tags() ])
+		for i in documents[1:]:
+			self._translate_file(i, False)
+		return self._translate_file(document, plurals)
+
+	def translate_string(self, source, plural_definition=True):
+		'''Translates TeX source given as str or bytes-like object; does not access any files
+
+		Without plural_definition, the \\gettextplural definition needed by plural forms is not
+		inserted; fragments can then be combined and the caller emits plural_definition() once.
+		'''
+		if isinstance(source, str):
+			source = source.encode(ENCODING)
+		elif not isinstance(source, (bytes, bytearray, mmap.mmap)):
+			source = bytes(source)
+		tags = Document.scan(source)
+		output = io.BytesIO()
+		Translation._write(source,
+			self._replacements(tags, source, plural_definition and Translation._needs_plural_definition(tags)), output)
+		return output.getvalue().decode(ENCODING)
+
+	@staticmethod
+	def _needs_plural_definition(tags):
+		return any([ i.name in PLURAL_TAGS and PluralForms.literal(i.args[-1].content) is None for i in tags ])
+
+	@staticmethod
+	def _write(doc, replacements, output):
+		with memoryview(doc) as view:
+			prev = 0
+			for begin_pos, end_pos, text in replacements:
+				output.write(view[prev:begin_pos])
+				output.write(text.encode(ENCODING))
+				prev = end_pos+1
+			output.write(view[prev:])
+
+	def translated_name(self, name):
+		root, ext = os.path.splitext(name)
+		return root+'.'+self.locale+ext
+
+	def _translate_file(self, document, plurals):
 		sys.stderr.write('Translating {} to {}...\n'.format(document, self))
-		tags = self.find_all_tags(document)
-		tags += document.find_tags('\\today', 0)
-		tags += document.find_tags('\\formatdate', 3)
-		tags = sorted(tags, key=lambda x: x.begin_pos)
-		translated, ext = os.path.splitext(self.input)
-		translated += '.' + self.locale + ext
-		with open(document.name) as input_file:
-			doc = input_file.read()
+		translated = self.translated_name(document.name)
+		with document.buffer() as doc, tempfile.NamedTemporaryFile(dir=os.path.dirname(translated) or '.',
+				prefix=os.path.basename(translated)+'.', suffix='.tmp', delete=False, buffering=1 << 16) as output:
+			temporary = output.name
+			try:
+				Translation._write(doc, self._replacements(document.tags(), doc, plurals, dict(document.includes())), output)
+			except BaseException:
+				output.close()
+				os.remove(temporary)
+				raise
+		if os.path.exists(translated) and filecmp.cmp(temporary, translated, shallow=False):
+			os.remove(temporary)
+			sys.stderr.write('File {} is up to date\n'.format(translated))
+		else:
+			os.replace(temporary, translated)
 			sys.stderr.write('Generating file {}...\n'.format(translated))
-			with open(translated, 'w') as output:
-				elems = []
-				prev = 0
-				for i in tags:
-					elems.append(doc[prev:i.begin_pos])
-					elems.append(self.translate_tag(i))
-					prev = i.end_pos+1
-				elems.append(doc[prev:])
-				output.write(''.join(elems))
 		return Document.load(translated)
 
+	def _replacements(self, tags, doc, plurals, includes=None):
+		replacements = []
+		for i in tags:
+			if i.name in INCLUDE_TAGS:
+				if includes and i in includes:
+					text = i.name+'{'+self._translated_include(i.args[0].content.strip(), includes[i].name)+'}'
+					replacements.append((i.begin_pos, i.end_pos, text))
+				continue
+			replacements.append((i.begin_pos, i.end_pos, self.translate_tag(i)))
+		if plurals:
+			m = RE_BEGIN_DOCUMENT.search(doc)
+			preamble = m.end(1) if m else 0
+			replacements.insert(0, (preamble, preamble-1, self.plural_forms().definition()+'\n'))
+			replacements.sort(key=lambda x: x[0])
+		return replacements
+
+	def _translated_include(self, argument, name):
+		if os.path.splitext(name)[0].endswith(argument):
+			return argument+'.'+self.locale #extension appended by TeX
+		return self.translated_name(argument)
+
 	def find_all_tags(self, document):
-		tags = []
-		tags += document.find_tags('\\gettext')
-		tags += document.find_tags('\\pgettext', 2)
-		tags += document.find_tags('\\ngettext', 3)
-		tags += document.find_tags('\\npgettext', 4)
-		return tags
+		return [ i for j in document.documents() for i in j.tags() if i.name in TRANSLATION_TAGS ]
 
 	def generate_template(self, document):
-		with open(document.name) as doc:
-			doc = doc.read()
-			tags = self.find_all_tags(document)
-			tags = set(tags)
-			tags = sorted(tags, key=lambda x: x.begin_pos)
-			template_name, _ = os.path.splitext(document.name)
-			template_name = template_name+'.pot'
-			sys.stderr.write('Generating template "{}"...\n'.format(template_name))
-			with open(template_name, 'w') as template:
-				template.write('msgid ""\n')
-				template.write('msgstr ""\n')
-				#template.write('"Project-Id-Version: PACKAGE VERSION\\n"\n')
-				#template.write('"Report-Msgid-Bugs-To: \\n"\n')
-				##template.write('"POT-Creation-Date:   2014-05-03 22:18+0200\\n"\n')
-				#time = datetime.datetime.now(tz=tzlocal.get_localzone())
-				#time = time.strftime('%Y-%m-%d %H:%M%z')
-				#template.write('"POT-Creation-Date: {}\\n"\n'.format(time))
-				#template.write('"PO-Revision-Date: YEAR-MO-DA HO:MI+ZONE\\n"\n')
-				template.write('"Last-Translator: FULL NAME <EMAIL@ADDRESS>\\n"\n')
-				#template.write('"Language-Team: LANGUAGE <LL@li.org>\\n"\n')
-				template.write('"Language: \\n"\n')
-				template.write('"MIME-Version: 1.0\\n"\n')
-				template.write('"Content-Type: text/plain; charset=UTF-8\\n"\n')
-				template.write('"Content-Transfer-Encoding: 8bit\\n"\n')
-				template.write('"Plural-Forms: nplurals=INTEGER; plural=EXPRESSION;\\n"\n')
-				template.write('\n')
-				for tag in tags:
-					def escape(s):
-						return s.replace('\\', '\\\\').replace('\n', '"\n"')
-					if tag.name == '\\gettext':
-						template.write('{} "{}"\n'.format(self.TAG_MSGID, escape(tag.args[0].content)))
-						template.write('{} ""\n'.format(self.TAG_MSGSTR))
-					elif tag.name == '\\ngettext':
-						template.write('{} "{}"\n'.format(self.TAG_MSGID, escape(tag.args[0].content)))
-						template.write('{} "{}"\n'.format(self.TAG_MSGID_PLURAL, escape(tag.args[1].content)))
-						template.write('{}[0] ""\n'.format(self.TAG_MSGSTR))
-						template.write('{}[1] ""\n'.format(self.TAG_MSGSTR))
-					elif tag.name == '\\pgettext':
-						template.write('{} "{}"\n'.format(self.TAG_MSGCTXT, escape(tag.args[0].content)))
-						template.write('{} "{}"\n'.format(self.TAG_MSGID, escape(tag.args[1].content)))
-						template.write('{} ""\n'.format(self.TAG_MSGSTR))
-					elif tag.name == '\\npgettext':
-						template.write('{} "{}"\n'.format(self.TAG_MSGCTXT, escape(tag.args[0].content)))
-						template.write('{} "{}"\n'.format(self.TAG_MSGID, escape(tag.args[1].content)))
-						template.write('{} "{}"\n'.format(self.TAG_MSGID_PLURAL, escape(tag.args[2].content)))
-						template.write('{}[0] ""\n'.format(self.TAG_MSGSTR))
-						template.write('{}[1] ""\n'.format(self.TAG_MSGSTR))
-					template.write('\n')
-			return template_name
+		template_name = document.template_name()
+		sys.stderr.write('Generating template "{}"...\n'.format(template_name))
+		document.template().write(template_name)
+		return template_name
 
 	def translate_tag(self, tag):
 		if tag.name == '\\gettext':
-			if not self.file:
+			if not self.has_catalog():
 				return tag.args[0].content
 			else:
-				return self[(tag.args[0].content, None)][self.TAG_MSGSTR]
+				return self[(tag.args[0].content, None)].msgstr
 		elif tag.name == '\\ngettext':
-			if not self.file:
-				rule = DEFAULT_PLURAL
+			if not self.has_catalog():
 				variants = (tag.args[0].content, tag.args[1].content)
 			else:
-				rule = self.get_header('Plural-Forms')
-				variants = self[(tag.args[0].content, None)]
-				variants = [ (k, v) for k,v in variants.items() if k.startswith(self.TAG_MSGSTR+'[')]
-				variants = sorted(variants, key=lambda x: x[0])
-				variants = [ i[1] for i in variants ]
-			return convert_plurals(rule, tag.args[2].content, variants)
+				variants = self[(tag.args[0].content, None)].msgstr
+			return self._translate_plural(tag.args[2].content, variants)
 		elif tag.name == '\\pgettext':
-			if not self.file:
+			if not self.has_catalog():
 				return tag.args[1].content
-			return self[(tag.args[1].content, tag.args[0].content)][self.TAG_MSGSTR]
+			return self[(tag.args[1].content, tag.args[0].content)].msgstr
 		elif tag.name == '\\npgettext':
-			if not self.file:
-				rule = DEFAULT_PLURAL
+			if not self.has_catalog():
 				variants = (tag.args[1].content, tag.args[2].content)
 			else:
-				rule = self.get_header('Plural-Forms')
-				variants = self[(tag.args[1].content, tag.args[0].content)]
-				variants = [ (k, v) for k,v in variants.items() if k.startswith(self.TAG_MSGSTR+'[')]
-				variants = sorted(variants, key=lambda x: x[0])
-				variants = [ i[1] for i in variants ]
-			return convert_plurals(rule, tag.args[3].content, variants)
+				variants = self[(tag.args[1].content, tag.args[0].content)].msgstr
+			return self._translate_plural(tag.args[3].content, variants)
 		elif tag.name == '\\today':
-			return self._icu_date_full.format(float(datetime.datetime.now().timestamp()))
+			return format_date(self.locale, today())
 		elif tag.name == '\\formatdate':
-			return self._icu_date_full.format(float(datetime.datetime(*[int(i.content) for i in tag.args][::-1]).timestamp()))
+			import datetime
+			day, month, year = [ int(i.content) for i in tag.args ]
+			return format_date(self.locale, datetime.date(year, month, day))
 		else:
 			raise Exception('Unknown tag: '+tag.name)
 
+	def plural_definition(self):
+		'''TeX definition of the command selecting plural forms of this translation'''
+		return self.plural_forms().definition()
+
+	def _translate_plural(self, count, variants):
+		plural_forms = self.plural_forms()
+		n = PluralForms.literal(count)
+		if n is not None:
+			return plural_forms.choose(n, variants)
+		return plural_forms.select(plural_forms.call(count), variants)
+
+	def has_catalog(self):
+		return bool(self.file) or self._catalog is not None
+
+	def parse(self):
+		'''Loads the catalog of the translation, unless it is already loaded'''
+		if self.has_catalog():
+			self._ensure_parsed()
+
+	def reload(self):
+		self._parsed = None
+		self._plural_forms = None
+
 	def _ensure_parsed(self):
+		if self._parsed is not None:
+			return
+		if self._catalog is not None:
+			self._set_parsed(self._catalog)
+			return
 		if not self.file:
 			raise Exception('Translation instance has no associated file')
-		if self._parsed:
-			return
-		sys.stderr.write('Parsing {}\n'.format(self.file))
-		with open(self.file) as f:
-			self._parsed = {}
-			def add_tr(tag):
-				key = (tag[self.TAG_MSGID], tag.get(self.TAG_MSGCTXT, None))
-				if key in self._parsed:
-					raise Exception('Key already exists: '+repr(key))
-				self._parsed[key] = tag
-
-			tag = {}
-			def add_tag(key, value):
-				value = value.replace('\n', '').replace('""', '').strip('"').replace('\\\\', '\\')
-				tag[key] = value
-
-			next_tag = None
-			for line in f:
-				if line.startswith('#'):
-					continue
-				if not line.startswith('"'):
-					if tag and line.startswith(self.TAG_MSGID+' '):
-						add_tr(tag)
-						tag = {}
-
-					if next_tag is not None:
-						add_tag(next_tag, next_tag_content)
-
-					sep = line.find(' ')
-					next_tag = line[:sep].strip()
-					next_tag_content = line[sep:].strip()
-				else:
-					next_tag_content += line
-			add_tag(next_tag, next_tag_content)
-			add_tr(tag)
-
-		if ('',None) in self._parsed:
-			self._header = {}
-			headers = self._parsed.pop(('',None))[self.TAG_MSGSTR].split('\\n')
-			for i in headers:
-				sep = i.find(':')
-				key = i[:sep].strip()
-				value = i[sep+1:].strip()
-				if key:
-					self._header[key] = value
+		compiled = self.compiled_file()
+		if not catalog.CompiledCatalog.up_to_date(compiled, self.file):
+			sys.stderr.write('Compiling {} into {}\n'.format(self.file, compiled))
+			catalog.Catalog.read(self.file).write_mo(compiled)
+		self._set_parsed(catalog.CompiledCatalog(compiled))
+
+	def compiled_file(self):
+		root, _ = os.path.splitext(self.file)
+		return root+'.mo'
+
+	def _set_parsed(self, parsed):
+		self._parsed = parsed
+		self._plural_forms = None
+		self._header = parsed.header()
+
+	def plural_forms(self):
+		if self._plural_forms is None:
+			self._plural_forms = PluralForms(self.get_header('Plural-Forms') if self.has_catalog() else DEFAULT_PLURAL)
+		return self._plural_forms
 
 	def get_header(self, key):
 		self._ensure_parsed()
@@ -343,61 +618,355 @@ class Translation:
 		return self._parsed[key]
 
 def find_translations(input_file, directory=None, languages=None):
+	'''Translations of the document, i.e. <input root>.<locale>.po files, relative to directory'''
 	directory = directory or os.getcwd()
+	base_name, _ = os.path.splitext(input_file)
 	result = []
 	if languages:
-		base_name, _ = os.path.splitext(input_file)
 		for i in languages:
 			filename = os.path.join(directory, base_name+'.'+i+'.po')
 			result.append(Translation.load(input_file, filename, Translation.ALLOW_NOT_EXISTING))
 	else:
-		for i in os.listdir(directory):
-			if RE_PO_FILE.match(i):
+		directory = os.path.join(directory, os.path.dirname(base_name))
+		prefix = os.path.basename(base_name)+'.'
+		for i in sorted(os.listdir(directory)):
+			m = RE_PO_FILE.match(i)
+			if m and i == prefix+m.group(1)+'.po':
 				result.append(Translation.load(input_file, os.path.join(directory, i)))
 	return result
 
-def convert_plurals(description, n, variants):
+_formatters = {}
+_formatters_lock = threading.Lock()
+_today = None
+
+def formatter(locale, style='FULL'):
+	'''Process-wide ICU date formatter for the locale and style, created on first use'''
+	with _formatters_lock:
+		key = (locale, style)
+		if key not in _formatters:
+			import icu
+			_formatters[key] = icu.DateFormat.createDateInstance(
+				getattr(icu.DateFormat, style), icu.Locale.createFromName(locale))
+		return _formatters[key]
+
+@functools.lru_cache(maxsize=None)
+def format_date(locale, date, style='FULL'):
+	import datetime
+	return formatter(locale, style).format(float(datetime.datetime(date.year, date.month, date.day).timestamp()))
+
+def set_today(date):
+	'''Sets the date used for \\today, so that all documents of a build show the same one'''
+	global _today
+	_today = date
+
+def today():
+	if _today is None:
+		import datetime
+		set_today(datetime.date.today())
+	return _today
+
+def uses_dates(documents):
+	return any([ i.name in DATE_TAGS for j in documents for i in j.tags() ])
+
+def initialize_worker(locales, date):
+	'''Initializer of build worker processes: shares the date of the build and creates formatters up front
+
+	Pass locales only for documents that format dates. Without PyICU, formatters are not created, and
+	translating a date tag fails in the job that needs it.
+	'''
+	set_today(date)
 	try:
-		NPLURALS='nplurals'
-		PLURAL='plural'
-		desc = description.split(';')
-
-		nplurals = desc[0].strip()
-		if not nplurals.startswith(NPLURALS):
-			raise Exception('First element "{}" does not start with "{}"'.format(
-				nplurals, NPLURALS))
-		nplurals = nplurals[len(NPLURALS):]
-		nplurals = int(nplurals.strip('='))
-
-		plural = desc[1].strip()
-		if not plural.startswith(PLURAL):
-			raise Exception('Second element "{}" does not start with "{}"'.format(
-				plural, PLURAL))
-		plural = plural[len(PLURAL):]
-		plural = plural.strip('=')
-		plural = tex_math.Parser(plural)
+		for i in locales:
+			formatter(i)
+	except ImportError:
+		pass
+
+def translate_strings(sources, parsed=None, locale=None, plural_definition=True):
+	'''Translates TeX sources against one catalog (None for the source language), without file system access
+
+	To combine the results into one document, pass plural_definition=False and emit
+	Translation.from_catalog(parsed).plural_definition() once instead.
+	'''
+	if parsed is None:
+		translation = Translation(None, locale or 'en_US')
+	else:
+		translation = Translation.from_catalog(parsed, locale)
+	translation.parse()
+	return [ translation.translate_string(i, plural_definition) for i in sources ]
+
+class PluralForms:
+	COMMAND = '\\gettextplural'
+
+	def __init__(self, description):
+		try:
+			NPLURALS='nplurals'
+			PLURAL='plural'
+			desc = description.split(';')
+
+			nplurals = desc[0].strip()
+			if not nplurals.startswith(NPLURALS):
+				raise Exception('First element "{}" does not start with "{}"'.format(
+					nplurals, NPLURALS))
+			nplurals = nplurals[len(NPLURALS):]
+			self.nplurals = int(nplurals.strip('='))
+
+			plural = desc[1].strip()
+			if not plural.startswith(PLURAL):
+				raise Exception('Second element "{}" does not start with "{}"'.format(
+					plural, PLURAL))
+			plural = plural[len(PLURAL):]
+			self.plural = plural.strip('=')
+			import tex_math
+			self.rule = tex_math.Parser(self.plural).parse()
+		except Exception as e:
+			raise Exception('Plurals definition must be formed as "nplurals: <n>; plural=<rule>"')
+
+	def definition(self):
+		import tex_math
+		return tex_math.generate_command(self.COMMAND, self.plural)
+
+	def expression(self, n):
+		import tex_math
+		plural = tex_math.Parser(self.plural)
 		plural.override_identifier('n', n)
-		plural = tex_math.Generator(plural.parse()).generate()
-	except Exception as e:
-		raise Exception('Plurals definition must be formed as "nplurals: <n>; plural=<rule>"')
-
-	if len(variants) != nplurals:
-		raise Exception('Invalid number of variants found (expected {}, but {} found)'.format(nplurals, len(variants)))
-
-	s = ''
-	ending = ''
-	s += '\\setcounter{_gettext_n}{'
-	s += plural
-	s += '}'
-	for i in range(nplurals-1):
-		s += '\\ifthenelse{\\equal{\\value{_gettext_n}}{'+str(i)+'}}{'
-		s += variants[i]
-		s += '}{'
-		ending += '}'
-	s += variants[-1]
-	s += ending
-	return s
-	return 'convert\_plurals('+description+','+msgid1+','+msgid2+','+n+')'
+		return tex_math.Generator(plural.parse()).generate()
+
+	def call(self, n):
+		return self.COMMAND+'{'+n+'}'
+
+	@staticmethod
+	def literal(n):
+		n = n.strip()
+		return int(n) if re.fullmatch(r'[0-9]+', n) else None
+
+	def index(self, n):
+		import tex_math
+		return tex_math.Generator(self.rule).evaluate({'n': n})
+
+	def choose(self, n, variants):
+		if len(variants) != self.nplurals:
+			raise Exception('Invalid number of variants found (expected {}, but {} found)'.format(self.nplurals, len(variants)))
+		index = self.index(n)
+		return variants[index] if 0 <= index < len(variants) else variants[-1]
+
+	def select(self, index, variants):
+		if len(variants) != self.nplurals:
+			raise Exception('Invalid number of variants found (expected {}, but {} found)'.format(self.nplurals, len(variants)))
+
+		if self.nplurals == 1:
+			return variants[0]
+		s = ''
+		s += '\\setcounter{_gettext_n}{'
+		s += index
+		s += '}'
+		s += '\\ifcase\\value{_gettext_n}'
+		s += variants[0]
+		for i in variants[1:-1]:
+			s += '\\or '+i
+		s += '\\else '+variants[-1]
+		s += '\\fi'
+		return s
+
+def convert_plurals(description, n, variants):
+	plural_forms = PluralForms(description)
+	return plural_forms.select(plural_forms.expression(n), variants)
+
+class TestDocument(unittest.TestCase):
+	def test_scan(self):
+		doc = (
+			'\\gettext{Hello {\\bf world}!}\n'
+			'\\pgettext{ctx}{Hello}\n'
+			'\\today\n'
+			'\\gettextmathbool{1}\n'
+			'\\ngettext{One}\n{#1 many}{#1}\n'
+			'\\formatdate{21}{12}{2012}'
+		)
+		tags = Document.scan(doc)
+		self.assertEqual(['\\gettext', '\\pgettext', '\\today', '\\ngettext', '\\formatdate'],
+			[ i.name for i in tags ])
+		self.assertEqual('Hello {\\bf world}!', tags[0].args[0].content)
+		self.assertEqual(['ctx', 'Hello'], [ i.content for i in tags[1].args ])
+		self.assertEqual('\\today', doc[tags[2].begin_pos:tags[2].end_pos+1])
+		self.assertEqual(['One', '#1 many', '#1'], [ i.content for i in tags[3].args ])
+		self.assertEqual('}', doc[tags[4].end_pos])
+		self.assertEqual(len(doc)-1, tags[4].end_pos)
+
+	def test_scan_unbalanced(self):
+		with self.assertRaisesRegex(Exception, 'at line 2 '):
+			Document.scan('\n\\gettext{Hello')
+
+	def test_parse_once(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			name = os.path.join(directory, 'doc.tex')
+			with open(name, 'w') as f:
+				f.write('\\gettext{a} \\gettext{b} \\gettext{a} \\today')
+			document = Document(name)
+			tags = document.tags()
+			self.assertEqual(4, len(tags))
+			self.assertEqual(['a', 'b'], [ i.args[0].content for i in document.messages() ])
+			self.assertIs(tags, document.tags())
+			stat = os.stat(name)
+			os.utime(name, ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+			self.assertIs(tags, document.tags())
+			with open(name, 'w') as f:
+				f.write('\\gettext{c}')
+			self.assertEqual(['c'], [ i.args[0].content for i in document.messages() ])
+
+	def test_template(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			name = os.path.join(directory, 'doc.tex')
+			with open(name, 'w') as f:
+				f.write('\\pgettext{a}{b}\n\\pgettext{b}{a}\n\\gettext{b} \\gettext{b}\n\\pgettext{a}{b}')
+			self.assertNotEqual(hash(Document.scan('\\pgettext{a}{b}')[0]), hash(Document.scan('\\pgettext{b}{a}')[0]))
+			template = Document(name).template()
+			self.assertEqual([ (('b', 'a'), [name+':1', name+':4']), (('a', 'b'), [name+':2']), (('b', None), [name+':3']) ],
+				[ (i.key, i.references) for i in template ])
+
+	def test_initialize_worker(self):
+		import datetime
+		from unittest import mock
+		try:
+			with mock.patch.dict('sys.modules', {'icu': None}):
+				initialize_worker(['xx_XX'], datetime.date(2012, 12, 21))
+			self.assertEqual(datetime.date(2012, 12, 21), today())
+		finally:
+			set_today(None)
+
+	@unittest.skipUnless(importlib.util.find_spec('icu'), 'PyICU is required')
+	def test_dates(self):
+		import datetime
+		translation = Translation('doc.tex', 'en_US')
+		set_today(datetime.date(2012, 12, 21))
+		try:
+			today, date = Document.scan('\\today\\formatdate{21}{12}{2012}')
+			self.assertEqual(translation.translate_tag(date), translation.translate_tag(today))
+			self.assertIs(formatter('en_US'), formatter('en_US'))
+		finally:
+			set_today(None)
+
+	def test_translate_string(self):
+		parsed = catalog.Catalog.loads(
+			'msgid ""\n'
+			'msgstr ""\n'
+			'"Language: pl_PL\\n"\n'
+			'"Plural-Forms: nplurals=3; plural=(n==1 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2);\\n"\n'
+			'\n'
+			'msgid "Hello"\n'
+			'msgstr "Witaj"\n'
+			'\n'
+			'msgid "One"\n'
+			'msgid_plural "#1 many"\n'
+			'msgstr[0] "Jeden"\n'
+			'msgstr[1] "#1 kilka"\n'
+			'msgstr[2] "#1 wiele"\n')
+		translation = Translation.from_catalog(parsed)
+		self.assertEqual('pl_PL', translation.locale)
+		self.assertEqual('Witaj, #1 kilka \\input{a}', translation.translate_string('\\gettext{Hello}, \\ngettext{One}{#1 many}{3} \\input{a}'))
+		self.assertEqual('\\newcommand', translation.translate_string(b'\\ngettext{One}{#1 many}{#1}')[:11])
+		source = '% \\begin{document} \\% \\\\% \\begin{document}\n\\%\\begin{document}\\ngettext{One}{#1 many}{#1}'
+		translated = translation.translate_string(source)
+		self.assertEqual(source.index('\\begin{document}\\n'), translated.index('\\newcommand'))
+		self.assertEqual(source[:source.index('\\%\\begin')+2], translated[:source.index('\\%\\begin')+2])
+		fragments = translate_strings(['\\ngettext{One}{#1 many}{#1}']*2, parsed, plural_definition=False)
+		self.assertEqual([ translation.plural_forms().select(translation.plural_forms().call('#1'),
+			['Jeden', '#1 kilka', '#1 wiele']) ]*2, fragments)
+		self.assertTrue(translation.plural_definition().startswith('\\newcommand{\\gettextplural}'))
+		self.assertEqual(['Witaj', 'Hello'], translate_strings(['\\gettext{Hello}'], parsed)+translate_strings(['\\gettext{Hello}']))
+
+	def test_translate_failure(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			name = os.path.join(directory, 'doc.tex')
+			with open(name, 'w') as f:
+				f.write('\\gettext{a} \\gettext{missing}')
+			translation = Translation.from_catalog(catalog.Catalog.loads(
+				'msgid ""\nmsgstr "Language: de_DE\\n"\n\nmsgid "a"\nmsgstr "A"\n'))
+			with self.assertRaises(KeyError):
+				translation.translate(Document(name))
+			self.assertEqual(['doc.tex'], os.listdir(directory))
+
+	def test_generate_output(self):
+		import tempfile
+		from unittest import mock
+		with tempfile.TemporaryDirectory() as directory:
+			os.mkdir(os.path.join(directory, 'docs'))
+			for name in ('doc.de_DE.tex', 'ch.de_DE.tex'):
+				with open(os.path.join(directory, 'docs', name), 'w') as f:
+					f.write('\\include{docs/ch.de_DE}' if name.startswith('doc') else '')
+			cwd = os.getcwd()
+			os.chdir(directory)
+			try:
+				for output_directory in (None, 'build/de_DE'):
+					document = Document('docs/doc.de_DE.tex')
+					with mock.patch('subprocess.check_call') as check_call:
+						output = document.generate(output_directory)
+					self.assertIn('-output-directory='+os.path.dirname(output), check_call.call_args[0][0])
+					self.assertEqual(document.output(output_directory), output)
+					self.assertTrue(os.path.isdir(os.path.join(os.path.dirname(output), 'docs')))
+			finally:
+				os.chdir(cwd)
+
+	def test_includes(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			files = {
+				'main.tex': '\\gettext{a}\\input{one}\\include{sub/two.tex}\\input{missing}\\input plain',
+				'one.tex': '\\gettext{b}\\input{main.tex}',
+				'sub/two.tex': '\\gettext{a}\\subfile{three}',
+				'sub/three.tex': '\\gettext{c}',
+			}
+			os.mkdir(os.path.join(directory, 'sub'))
+			for name, content in files.items():
+				with open(os.path.join(directory, name), 'w') as f:
+					f.write(content)
+			cwd = os.getcwd()
+			os.chdir(directory)
+			try:
+				document = Document('main.tex')
+				self.assertEqual(['main.tex', 'one.tex', 'sub/two.tex', 'sub/three.tex'],
+					[ i.name for i in document.documents() ])
+				self.assertEqual(['a', 'b', 'c'], [ i.args[0].content for i in document.messages() ])
+				self.assertEqual(['\\input', '\\include'], [ i.name for i, _ in document.includes() ])
+				self.assertEqual(4, len(document._graph))
+			finally:
+				os.chdir(cwd)
+
+	def test_find_translations(self):
+		import tempfile
+		with tempfile.TemporaryDirectory() as directory:
+			for i in ('doc.de_DE.po', 'doc.pl_PL.po', 'doc.v2.fr_FR.po', 'other.de_DE.po', 'doc.tex'):
+				open(os.path.join(directory, i), 'w').close()
+			self.assertEqual(['de_DE', 'pl_PL'], [ i.locale for i in find_translations('doc.tex', directory) ])
+			self.assertEqual(os.path.join(directory, 'doc.de_DE.po'), find_translations('doc.tex', directory)[0].file)
+			self.assertEqual(['fr_FR'], [ i.locale for i in find_translations(os.path.join(directory, 'doc.v2.tex')) ])
+
+	def test_plural_forms(self):
+		plural_forms = PluralForms('nplurals=3; plural=n==1 ? 0 : n==2 ? 1 : 2;')
+		self.assertEqual(3, plural_forms.nplurals)
+		self.assertEqual('\\newcommand{\\gettextplural}[1]{'+plural_forms.expression('#1')+'}',
+			plural_forms.definition())
+		self.assertEqual(
+			'\\setcounter{_gettext_n}{\\gettextplural{#1}}'+
+			'\\ifcase\\value{_gettext_n}a\\or b\\else c\\fi',
+			plural_forms.select(plural_forms.call('#1'), ['a', 'b', 'c']))
+		self.assertEqual('a', PluralForms('nplurals=1; plural=0;').select('#1', ['a']))
+		with self.assertRaises(Exception):
+			plural_forms.select('0', ['a', 'b'])
+		self.assertEqual(['c', 'a', 'b', 'c'], [ plural_forms.choose(i, ['a', 'b', 'c']) for i in range(4) ])
+		self.assertEqual(2, PluralForms.literal(' 2 '))
+		self.assertIsNone(PluralForms.literal('#1'))
+		self.assertIsNone(PluralForms.literal('\u00b2'))
+
+	def test_line_index(self):
+		doc = 'ab\ncd\n\nef'
+		index = LineIndex(doc)
+		self.assertEqual(4, len(index))
+		self.assertEqual([1, 1, 1, 2, 2, 2, 3, 4, 4],
+			[ index.line(i) for i in range(len(doc)) ])
+		self.assertEqual([1, 2, 3, 1, 2, 3, 1, 1, 2],
+			[ index.column(i) for i in range(len(doc)) ])
 
 if __name__ == '__main__':
 	import unittest